@@ -11,7 +11,16 @@ import pymc_bart as pmb
 
 import warnings
 
+from compile_cache import enable_numba_cache
+from partial_dependence import plot_pdp
+from posterior_predict import posterior_mean_hdi
+from streaming import StreamingSummary
+from sweep import chain_mean, run_sweep
+from tree_shap import shap_values
+
 warnings.simplefilter(action="ignore", category=FutureWarning)
+# Compile the numba kernels of PyMC-BART once, not in every chain of every model
+enable_numba_cache()
 
 # General settings
 RANDOM_SEED = 4579
@@ -117,16 +126,28 @@ pmb.plot_convergence(idata_bikes, var_name="μ")
 plt.savefig("bikes_diagnostics_bart_rv.png")
 
 # Partial dependence plot
-pmb.plot_pdp(μ_, X=X, Y=Y, grid=(2, 2), func=np.exp)
+plot_pdp(μ_, X=X, Y=Y, grid=(2, 2), func=np.exp)
 plt.savefig("bikes_pdp.png", bbox_inches="tight")
 
+# Shapley values of the predictions of log(count), averaged over the posterior
+shap, _ = shap_values(
+    μ_.owner.op.all_trees, X, np.random.default_rng(RANDOM_SEED), size=100
+)
+shap_mean = shap.mean(0)[..., 0]
+_, axes = plt.subplots(1, 4, figsize=(12, 3), sharey=True)
+for i, ax in enumerate(axes):
+    ax.plot(X.iloc[:, i], shap_mean[:, i], ".", alpha=0.5)
+    ax.set_xlabel(X.columns[i])
+axes[0].set_ylabel("Shapley value")
+plt.savefig("bikes_shap.png", bbox_inches="tight")
+
 # Variable Importance
 labels = ["hour", "temperature", "humidity", "windspeed"]
 pmb.utils.plot_variable_importance(idata_bikes, μ_, X, samples=100)
 plt.savefig("bikes_VI-correlation.png")
 
 # Free memory
-del idata_bikes, μ, μ_
+del idata_bikes, μ, μ_, shap, shap_mean
 
 
 # Bikes example with different number of trees
@@ -182,6 +203,7 @@ Y = np.random.normal(f_x, 1)
 # Different number of variables
 num_covariables = ["5", "10", "100", "1000"]
 idatas = {}
+μ_summaries = {}
 all_trees = {}
 VIs = []
 for num_covariable in num_covariables:
@@ -189,8 +211,14 @@ for num_covariable in num_covariables:
         σ = pm.HalfNormal("σ", 1)
         μ = pmb.BART("μ", X[:, : int(num_covariable)], Y, m=200)
         y = pm.Normal("y", mu=μ, sigma=σ, observed=Y)
+        # μ is only plotted as a mean and HDI, so its draws are not stored
+        μ_summaries[num_covariable] = StreamingSummary("μ", hdi_prob=0.9)
         idata = pm.sample(
-            chains=4, compute_convergence_checks=False, random_seed=RANDOM_SEED
+            chains=4,
+            compute_convergence_checks=False,
+            random_seed=RANDOM_SEED,
+            var_names=["σ"],
+            callback=μ_summaries[num_covariable],
         )
         idatas[num_covariable] = idata
         all_trees[num_covariable] = μ
@@ -214,20 +242,18 @@ for i, (name, ax) in enumerate(zip(num_covariables * 2, axes.ravel())):
     ax.axline([0, 0], [1, 1], color="0.5")
     if i <= 3:  # in-sample
         ax.set_title(f"p={name}")
-        μs = idatas[name].posterior["μ"].stack(samples=["chain", "draw"])
-        mean = μs.mean("samples")
-        hdi = az.hdi(μs.T.values, hdi_prob=0.9)
+        mean, hdi = μ_summaries[name].mean(), μ_summaries[name].hdi()
         yerr = np.vstack([mean - hdi[:, 0], hdi[:, 1] - mean])
         ax.errorbar(f_x, mean, yerr, linestyle="None", marker=".", alpha=0.5)
     elif i > 3:  # Out-of-sample
-        μ_pred = pmb.utils._sample_posterior(
+        mean, hdi = posterior_mean_hdi(
             all_trees[name].owner.op.all_trees,
             X_new[:, : int(name)],
             np.random.default_rng(RANDOM_SEED),
             size=500,
-        ).squeeze()
-        mean = μ_pred.mean(0)
-        hdi = az.hdi(μ_pred, hdi_prob=0.9)
+            hdi_prob=0.9,
+        )
+        mean, hdi = mean.squeeze(), hdi.squeeze()
         yerr = np.vstack([mean - hdi[:, 0], hdi[:, 1] - mean])
         ax.errorbar(
             f_x_new,
@@ -260,12 +286,14 @@ fig = plt.figure()
 
 for num, l in zip(num_covariables, lim):
     var_id = range(min(10, int(num)))
-    pmb.plot_pdp(all_trees[num], X, Y, var_idx=var_id, grid=(1, l), figsize=(10, 2))
+    # Only the covariates the model was fitted with
+    X_num = X[:, : int(num)]
+    plot_pdp(all_trees[num], X_num, Y, var_idx=var_id, grid=(1, l), figsize=(10, 2))
     plt.ylim(10, 20)
     plt.savefig(f"pdps_friedman_{num}.png", bbox_inches="tight")
 
 # Free memory
-del idata, idatas, all_trees
+del idata, idatas, μ_summaries, all_trees
 
 
 # Friedman trees test
@@ -314,78 +342,44 @@ del idata, idatas, μ
 trees = [10, 20, 50, 100, 200]
 alphas = [0.1, 0.45, 0.95]
 betas = [1, 2, 10]
-idatas_at = {
-    "10": {
-        "0.1": {"1": {}, "2": {}, "10": {}},
-        "0.45": {"1": {}, "2": {}, "10": {}},
-        "0.95": {"1": {}, "2": {}, "10": {}},
-    },
-    "20": {
-        "0.1": {"1": {}, "2": {}, "10": {}},
-        "0.45": {"1": {}, "2": {}, "10": {}},
-        "0.95": {"1": {}, "2": {}, "10": {}},
-    },
-    "50": {
-        "0.1": {"1": {}, "2": {}, "10": {}},
-        "0.45": {"1": {}, "2": {}, "10": {}},
-        "0.95": {"1": {}, "2": {}, "10": {}},
-    },
-    "100": {
-        "0.1": {"1": {}, "2": {}, "10": {}},
-        "0.45": {"1": {}, "2": {}, "10": {}},
-        "0.95": {"1": {}, "2": {}, "10": {}},
-    },
-    "200": {
-        "0.1": {"1": {}, "2": {}, "10": {}},
-        "0.45": {"1": {}, "2": {}, "10": {}},
-        "0.95": {"1": {}, "2": {}, "10": {}},
-    },
-}
-
-all_trees_at = {
-    "10": {
-        "0.1": {"1": {}, "2": {}, "10": {}},
-        "0.45": {"1": {}, "2": {}, "10": {}},
-        "0.95": {"1": {}, "2": {}, "10": {}},
-    },
-    "20": {
-        "0.1": {"1": {}, "2": {}, "10": {}},
-        "0.45": {"1": {}, "2": {}, "10": {}},
-        "0.95": {"1": {}, "2": {}, "10": {}},
-    },
-    "50": {
-        "0.1": {"1": {}, "2": {}, "10": {}},
-        "0.45": {"1": {}, "2": {}, "10": {}},
-        "0.95": {"1": {}, "2": {}, "10": {}},
-    },
-    "100": {
-        "0.1": {"1": {}, "2": {}, "10": {}},
-        "0.45": {"1": {}, "2": {}, "10": {}},
-        "0.95": {"1": {}, "2": {}, "10": {}},
-    },
-    "200": {
-        "0.1": {"1": {}, "2": {}, "10": {}},
-        "0.45": {"1": {}, "2": {}, "10": {}},
-        "0.95": {"1": {}, "2": {}, "10": {}},
-    },
-}
+
+
+def build_friedman_model(data, m, alpha, beta):
+    X, Y = data
+    with pm.Model() as model:
+        μ = pmb.BART("μ", X, Y, m=m, alpha=alpha, beta=beta)
+        σ = pm.HalfNormal("σ", 1)
+        y = pm.Normal("y", μ, σ, observed=Y)
+    return model
+
+
+def posterior_mean(model, idata, summaries):
+    return summaries["μ"].mean()
+
 
 # run model
-for m in trees:
-    for alpha in alphas:
-        for beta in betas:
-            with pm.Model() as model:
-                μ = pmb.BART("μ", X, Y, m=m, alpha=alpha, beta=beta)
-                σ = pm.HalfNormal("σ", 1)
-                y = pm.Normal("y", μ, σ, observed=Y)
-                idata = pm.sample(
-                    chains=4,
-                    compute_convergence_checks=False,
-                    idata_kwargs={"log_likelihood": True},
-                    random_seed=RANDOM_SEED,
-                )
-                idatas_at[str(m)][str(alpha)][str(beta)] = idata
-                all_trees_at[str(m)][str(alpha)][str(beta)] = list(μ.owner.op.all_trees)
+sweep = run_sweep(
+    build_friedman_model,
+    [
+        {"m": m, "alpha": alpha, "beta": beta}
+        for m in trees
+        for alpha in alphas
+        for beta in betas
+    ],
+    (X, Y),
+    "sweeps/friedman_trees_alphas_betas",
+    chains=4,
+    seed=RANDOM_SEED,
+    progress=True,
+    summarize=posterior_mean,
+    stream=["μ"],
+)
+μ_means = {}
+for cell in sweep.values():
+    params = cell["params"]
+    μ_means[(params["m"], params["alpha"], params["beta"])] = chain_mean(
+        cell["summaries"]
+    )
 
 # boxplot
 fig, axes = plt.subplots(
@@ -396,13 +390,7 @@ i = 0
 for alpha in alphas:
     for m in trees:
         ax = axes[i]
-        means = [
-            idatas_at[str(m)][str(alpha)][str(beta)]["posterior"]["μ"].mean(
-                ("chain", "draw")
-            )
-            - Y
-            for beta in betas
-        ]
+        means = [μ_means[(m, alpha, beta)] - Y for beta in betas]
         box = ax.boxplot(
             means,
             notch=True,
@@ -426,7 +414,7 @@ fig.supylabel(r"μ - Y$_{(data)}$", fontsize=16)
 plt.savefig("boxplots_friedman_i2.png")
 
 # Free memory
-del idata, idatas_at, all_trees_at, μ
+del sweep, μ_means
 
 
 # Coal mining disaster
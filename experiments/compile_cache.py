@@ -0,0 +1,74 @@
+"""On-disk cache for the numba kernels of PyMC-BART.
+
+PyMC-BART compiles its numba kernels (`fast_mean`, `fast_linear_fit`, the split rules,
+...) the first time they are called in every Python process, which adds a couple of
+seconds to the first draw of every chain, since `pm.sample` runs each chain in a new
+process. The kernels are not declared with ``cache=True``, so `enable_numba_cache`
+turns numba's on-disk cache on for them; after the first run they are loaded from disk
+instead of compiled.
+
+The likelihood compiled by `PGBART` is a PyTensor function, whose C code is already
+cached in PyTensor's ``compiledir`` (``~/.pytensor`` by default, see ``PYTENSOR_FLAGS``)
+and shared by every model with the same operations and dtypes.
+
+Call `enable_numba_cache` once, after importing `pymc_bart` and before sampling:
+
+    from compile_cache import enable_numba_cache
+
+    enable_numba_cache()
+
+The chains started by `pm.sample` inherit the cache when they are forked, the default
+on Linux. With the "spawn" or "forkserver" start methods they import PyMC-BART again
+and compile the kernels as usual.
+"""
+
+import importlib
+import inspect
+import pkgutil
+
+from numba.core.registry import CPUDispatcher
+
+
+def numba_kernels(package="pymc_bart"):
+    """Yield the numba-compiled functions and static methods defined in `package`."""
+    package = importlib.import_module(package)
+    modules = [package]
+    for info in pkgutil.walk_packages(package.__path__, f"{package.__name__}."):
+        modules.append(importlib.import_module(info.name))
+
+    for module in modules:
+        for obj in vars(module).values():
+            # Skip the objects that the module imported from elsewhere
+            if getattr(obj, "__module__", None) != module.__name__:
+                continue
+            if isinstance(obj, CPUDispatcher):
+                yield obj
+            elif inspect.isclass(obj):
+                for attr in vars(obj).values():
+                    if isinstance(attr, staticmethod):
+                        attr = attr.__func__
+                    if isinstance(attr, CPUDispatcher):
+                        yield attr
+
+
+def enable_numba_cache(package="pymc_bart"):
+    """Cache the machine code of the numba kernels of `package` on disk.
+
+    Kernels already compiled in this process are left as they are, so this should be
+    called before building the first model. The cache is written to
+    ``NUMBA_CACHE_DIR`` when it is set. Otherwise it goes to the ``__pycache__``
+    directory next to the sources of the package, or, if that is not writable, to
+    numba's user-wide cache directory (``~/.cache/numba`` on Linux).
+
+    Returns
+    -------
+    list of str
+        Names of the kernels whose cache was enabled.
+    """
+    enabled = []
+    for kernel in numba_kernels(package):
+        if kernel.signatures:
+            continue
+        kernel.enable_caching()
+        enabled.append(kernel.py_func.__qualname__)
+    return enabled
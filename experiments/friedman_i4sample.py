@@ -12,6 +12,8 @@ import pymc_bart as pmb
 from pymc_bart.pgbart import compute_prior_probability
 import pandas as pd
 
+from sweep import chain_mean, run_sweep
+
 # Configuration
 RANDOM_SEED = 8457
 rng = np.random.RandomState(RANDOM_SEED)
@@ -32,14 +34,7 @@ Y = rng.normal(f_x, 1)
 
 trees = [10, 20, 50, 100, 200]
 alphas = [0.1, 0.25, 0.5]
-idatas_at = {
-    "10": {"0.1": {}, "0.25": {}, "0.5": {}},
-    "20": {"0.1": {}, "0.25": {}, "0.5": {}},
-    "50": {"0.1": {}, "0.25": {}, "0.5": {}},
-    "100": {"0.1": {}, "0.25": {}, "0.5": {}},
-    "200": {"0.1": {}, "0.25": {}, "0.5": {}},
-}
-m_trees = {
+trees_length = {
     "10": {"0.1": {}, "0.25": {}, "0.5": {}},
     "20": {"0.1": {}, "0.25": {}, "0.5": {}},
     "50": {"0.1": {}, "0.25": {}, "0.5": {}},
@@ -48,21 +43,56 @@ m_trees = {
 }
 
 
+def tree_depths(all_trees):
+    """Depth of every posterior tree of a BART variable."""
+    depths = []
+    for sample in all_trees:
+        # Each draw holds one row of trees per output dimension
+        for odim_trees in sample:
+            for tree in odim_trees:
+                index = max(tree.tree_structure.keys())
+                depths.append(pmb.tree.get_depth(index))
+    return pd.Series(depths)
+
+
+def build_model(data, m, alpha):
+    X, Y = data
+    with pm.Model() as model:
+        μ = pmb.BART("μ", X, Y, m=m, alpha=alpha)
+        σ = pm.HalfNormal("σ", 1)
+        y = pm.Normal("y", μ, σ, observed=Y)
+    return model
+
+
+def summarize(model, idata):
+    """Keep only what the plots need, the 15 models do not fit in memory together."""
+    return {
+        "μ_mean": idata.posterior["μ"].mean(("chain", "draw")).values,
+        "depths": tree_depths(model["μ"].owner.op.all_trees),
+    }
+
+
 # Run model
-for m in trees:
-    for alpha in alphas:
-        with pm.Model() as model:
-            μ = pmb.BART("μ", X, Y, m=m, alpha=alpha)
-            σ = pm.HalfNormal("σ", 1)
-            y = pm.Normal("y", μ, σ, observed=Y)
-            idata = pm.sample(
-                chains=4,
-                compute_convergence_checks=False,
-                idata_kwargs={"log_likelihood": True},
-                random_seed=RANDOM_SEED,
-            )
-            idatas_at[str(m)][str(alpha)] = idata
-            m_trees[str(m)][str(alpha)] = μ.owner.op.all_trees
+sweep = run_sweep(
+    build_model,
+    [{"m": m, "alpha": alpha} for m in trees for alpha in alphas],
+    (X, Y),
+    "sweeps/friedman_i4sample",
+    chains=4,
+    seed=RANDOM_SEED,
+    progress=True,
+    summarize=summarize,
+    idata_kwargs={"log_likelihood": True},
+)
+μ_means = {str(m): {} for m in trees}
+paths = {str(m): {} for m in trees}
+for cell in sweep.values():
+    m, alpha = str(cell["params"]["m"]), str(cell["params"]["alpha"])
+    μ_means[m][alpha] = chain_mean([chain["μ_mean"] for chain in cell["summaries"]])
+    trees_length[m][alpha] = pd.concat(
+        [chain["depths"] for chain in cell["summaries"]], ignore_index=True
+    )
+    paths[m][alpha] = cell["path"]
 
 
 # Boxplots
@@ -71,10 +101,7 @@ fig, axes = plt.subplots(1, 5, figsize=(10, 3), sharey=True)
 axes = axes.ravel()
 
 for m, ax in zip(trees, axes):
-    means = [
-        idatas_at[str(m)][str(alpha)]["posterior"]["μ"].mean(("chain", "draw")) - f_x
-        for alpha in alphas
-    ]
+    means = [μ_means[str(m)][str(alpha)] - f_x for alpha in alphas]
     box = ax.boxplot(
         means,
         notch=True,
@@ -96,38 +123,13 @@ plt.savefig("boxplots_friedman_i4samp.png")
 
 # PSIS-LOO-CV
 model_compare = az.compare(
-    {
-        "m10": idatas_at["10"]["0.25"],
-        "m20": idatas_at["20"]["0.25"],
-        "m50": idatas_at["50"]["0.25"],
-        "m100": idatas_at["100"]["0.25"],
-        "m200": idatas_at["200"]["0.25"],
-    }
+    {f"m{m}": az.from_netcdf(paths[str(m)]["0.25"]) for m in trees}
 )
 
 az.plot_compare(model_compare, figsize=(11, 5))
 plt.savefig("loo_friedman_i4samp.png")
 
 
-# Tree extraction
-trees_length = {
-    "10": {"0.1": {}, "0.25": {}, "0.5": {}},
-    "20": {"0.1": {}, "0.25": {}, "0.5": {}},
-    "50": {"0.1": {}, "0.25": {}, "0.5": {}},
-    "100": {"0.1": {}, "0.25": {}, "0.5": {}},
-    "200": {"0.1": {}, "0.25": {}, "0.5": {}},
-}
-
-for m in trees:
-    for alpha in alphas:
-        tmp_list = []
-        chain = m_trees[str(m)][str(alpha)]
-        for sample in chain:
-            for tree in sample:
-                index = max(tree.tree_structure.keys())
-                tmp_list.append(pmb.tree.get_depth(index))
-        trees_length[f"{m}"][f"{alpha}"] = pd.Series(tmp_list)
-
 # Trees' depth probabilities based on alpha values
 prob_alphas = []
 for alpha in alphas:
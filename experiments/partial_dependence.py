@@ -0,0 +1,183 @@
+"""Partial dependence of BART variables, computed from the structure of the trees.
+
+`pmb.plot_pdp` computes the partial dependence of a variable by traversing every tree
+with all the other variables excluded, so that each split on an excluded variable
+weights both children by the fraction of training rows that went to each. That
+traversal only depends on the grid of values of the plotted variable, not on the rows
+of `X`. What is left to exploit is that
+
+* a tree that never splits on the variable is traversed with every variable excluded,
+  so its contribution is computed once per tree and shared by all the variables that
+  the tree does not use;
+* the posterior draws are selected and read once for all the variables, with
+  `posterior_predict.select_draws`, instead of once per variable;
+* the excluded variables are a set, so each split checks them in constant time
+  instead of scanning a list of all the other covariates.
+
+With many covariates, most trees do not split on a given variable, so the cost per
+variable drops from every tree to the few trees that use it.
+"""
+
+import warnings
+
+import arviz as az
+import numpy as np
+from pymc_bart.utils import (
+    _get_axes,
+    _prepare_plot_data,
+    _create_pdp_data,
+    _smooth_mean,
+)
+
+from posterior_predict import select_draws
+
+
+def partial_dependence(all_trees, fake_X, var_idx, rng, size=200, shape=1):
+    """Partial dependence of the variables `var_idx` over the grid `fake_X`.
+
+    Parameters
+    ----------
+    all_trees : list
+        Posterior trees of a BART variable, i.e. ``bartrv.owner.op.all_trees``.
+    fake_X : ndarray
+        Grid with shape (grid, p), as built by `pmb.utils._create_pdp_data`. Only
+        column ``var`` is used for the partial dependence of variable ``var``.
+    var_idx : list of int
+        Indices of the variables.
+    rng : numpy.random.Generator
+        Random number generator used to select the posterior draws.
+    size : int
+        Number of posterior draws, shared by all the variables.
+    shape : int
+        Shape of the BART variable.
+
+    Returns
+    -------
+    ndarray
+        Partial dependence with shape (len(var_idx), size, grid, shape).
+    """
+    n_vars = fake_X.shape[1]
+    var_idx = list(var_idx)
+    selected, inverse = select_draws(all_trees, rng, size)
+    trees_shape = len(selected[0])
+    leaves_shape = shape // trees_shape
+
+    all_vars = set(range(n_vars))
+    excluded = [all_vars - {var} for var in var_idx]
+    p_d = np.zeros(
+        (len(var_idx), len(selected), trees_shape, leaves_shape, fake_X.shape[0])
+    )
+    for u, draw in enumerate(selected):
+        for odim, odim_trees in enumerate(draw):
+            for tree in odim_trees:
+                split_vars = set(tree.get_split_variables())
+                uses = np.array([var in split_vars for var in var_idx])
+                if not uses.all():
+                    p_d[~uses, u, odim] += tree.predict(
+                        x=fake_X, excluded=all_vars, shape=leaves_shape
+                    )
+                for k in np.flatnonzero(uses):
+                    p_d[k, u, odim] += tree.predict(
+                        x=fake_X, excluded=excluded[k], shape=leaves_shape
+                    )
+
+    return (
+        p_d[:, inverse]
+        .transpose((0, 1, 4, 2, 3))
+        .reshape((len(var_idx), size, fake_X.shape[0], shape))
+    )
+
+
+def plot_pdp(
+    bartrv,
+    X,
+    Y=None,
+    xs_interval="quantiles",
+    xs_values=None,
+    var_idx=None,
+    var_discrete=None,
+    func=None,
+    samples=200,
+    random_seed=None,
+    sharey=True,
+    smooth=True,
+    grid="long",
+    color="C0",
+    color_mean="C0",
+    alpha=0.1,
+    figsize=None,
+    smooth_kwargs=None,
+    ax=None,
+):
+    """Partial dependence plot, with the same arguments and output as `pmb.plot_pdp`.
+
+    Unlike `pmb.plot_pdp` in PyMC-BART 0.5.12, the variables in `var_idx` are the
+    ones plotted, also when `var_idx` is not ``range(n)``.
+    """
+    all_trees = bartrv.owner.op.all_trees
+    rng = np.random.default_rng(random_seed)
+
+    if func is None:
+
+        def identity(x):
+            return x
+
+        func = identity
+
+    (
+        X,
+        x_labels,
+        y_label,
+        _,
+        var_idx,
+        var_discrete,
+        xs_interval,
+        xs_values,
+    ) = _prepare_plot_data(X, Y, xs_interval, xs_values, var_idx, var_discrete)
+
+    fig, axes, shape = _get_axes(bartrv, var_idx, grid, sharey, figsize, ax)
+
+    fake_X = _create_pdp_data(X, xs_interval, xs_values)
+    p_ds = partial_dependence(all_trees, fake_X, var_idx, rng, samples, shape)
+
+    count = 0
+    for var, label, p_d in zip(var_idx, x_labels, p_ds):
+        with warnings.catch_warnings():
+            warnings.filterwarnings(
+                "ignore", message="hdi currently interprets 2d data"
+            )
+            new_x = fake_X[:, var]
+            for s_i in range(shape):
+                p_di = func(p_d[:, :, s_i])
+                if var in var_discrete:
+                    _, idx_uni = np.unique(new_x, return_index=True)
+                    y_means = p_di.mean(0)[idx_uni]
+                    hdi = az.hdi(p_di)[idx_uni]
+                    axes[count].errorbar(
+                        new_x[idx_uni],
+                        y_means,
+                        (y_means - hdi[:, 0], hdi[:, 1] - y_means),
+                        fmt=".",
+                        color=color,
+                    )
+                    axes[count].set_xticks(new_x[idx_uni])
+                else:
+                    az.plot_hdi(
+                        new_x,
+                        p_di,
+                        smooth=smooth,
+                        fill_kwargs={"alpha": alpha, "color": color},
+                        ax=axes[count],
+                    )
+                    if smooth:
+                        x_data, y_data = _smooth_mean(new_x, p_di, "pdp", smooth_kwargs)
+                        axes[count].plot(x_data, y_data, color=color_mean)
+                    else:
+                        axes[count].plot(new_x, p_di.mean(0), color=color_mean)
+                axes[count].set_xlabel(label)
+
+                count += 1
+
+    fig.text(-0.05, 0.5, y_label, va="center", rotation="vertical", fontsize=15)
+
+    return axes
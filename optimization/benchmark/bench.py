@@ -0,0 +1,553 @@
+"""Benchmark suite for the PGBART sampler on the case studies.
+
+Run the grid of models × trees × particles and store the results as JSON:
+
+    python bench.py run --models biking coal --trees 50 200 --particles 20 60
+
+Measure the startup time with cold and warm compilation caches:
+
+    python bench.py run --models biking --trees 50 --particles 20 --startup
+
+Run the sampler in single precision (see precision.py):
+
+    python bench.py run --models friedman --dtype float32 --output results/float32.json
+
+Compare two result files and flag regressions:
+
+    python bench.py compare results/base.json results/new.json --threshold 0.1
+
+Compare a float32 run with a float64 one:
+
+    python bench.py compare results/base.json results/float32.json --across-dtypes
+"""
+
+import argparse
+import functools
+import importlib.util
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import time
+
+from datetime import datetime, timezone
+from importlib import metadata
+from pathlib import Path
+from tempfile import TemporaryDirectory
+
+import numpy as np
+
+HERE = Path(__file__).resolve().parent
+CASE_STUDIES = HERE.parent / "case_studies"
+EXPERIMENTS = HERE.parents[1] / "experiments"
+
+MODELS = ["coal", "biking", "space_influenza", "friedman"]
+PERCENTILES = [50, 90, 99]
+# Metrics used by `compare`, all of them are "lower is better"
+METRICS = [
+    ("setup_s",),
+    ("first_astep_s",),
+    ("warmup", "mean_s"),
+    ("steady", "mean_s"),
+    ("steady", "p50_s"),
+    ("steady", "p90_s"),
+    ("steady", "p99_s"),
+    ("peak_rss_mb",),
+    ("total_allocations",),
+    ("peak_heap_mb",),
+]
+
+
+def load_module(path):
+    """Import a Python file as a module."""
+    spec = importlib.util.spec_from_file_location(path.stem, path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def load_case_study(model):
+    """Import `case_studies/bart_case_<model>.py` as a module."""
+    return load_module(CASE_STUDIES / f"bart_case_{model}.py")
+
+
+def latency_summary(latencies):
+    """Summary statistics, in seconds, of per-iteration `astep` latencies."""
+    if latencies.size == 0:
+        return None
+    summary = {
+        "iters": int(latencies.size),
+        "total_s": float(latencies.sum()),
+        "mean_s": float(latencies.mean()),
+        "min_s": float(latencies.min()),
+        "max_s": float(latencies.max()),
+    }
+    for q, value in zip(PERCENTILES, np.percentile(latencies, PERCENTILES)):
+        summary[f"p{q}_s"] = float(value)
+    return summary
+
+
+def peak_rss_mb():
+    """Peak resident set size of the current process in MB."""
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS and in kilobytes on Linux
+    if sys.platform == "darwin":
+        return maxrss / 1024**2
+    return maxrss / 1024
+
+
+def sample(step, iters, warmup):
+    """Run `astep`, stopping tuning after `warmup` iterations as `pm.sample` does."""
+    latencies = np.empty(iters)
+    for i in range(iters):
+        if i == warmup:
+            step.stop_tuning()
+        start = time.perf_counter()
+        step.astep(i)
+        latencies[i] = time.perf_counter() - start
+    return latencies
+
+
+def phase_summary(draws, warmup, steady_mean):
+    """Mean time and calls per iteration of each phase after tuning.
+
+    `draws` are the stats returned by `InstrumentedPGBART.astep` for every iteration.
+    """
+    steady = draws[warmup:]
+    phases = [key[len("time_") :] for key in steady[0] if key.startswith("time_")]
+    summary = {}
+    for phase in phases:
+        mean = float(np.mean([draw[f"time_{phase}"] for draw in steady]))
+        summary[phase] = {
+            "mean_s": mean,
+            "share": mean / steady_mean,
+            "calls": float(np.mean([draw[f"calls_{phase}"] for draw in steady])),
+        }
+    return summary
+
+
+def run_cell(
+    model,
+    trees,
+    particles,
+    iters,
+    warmup,
+    seed,
+    memray_file=None,
+    phases=None,
+    numba_cache=False,
+    dtype=None,
+):
+    """Benchmark one cell of the grid. Runs in its own process."""
+    np.random.seed(seed)
+    module = load_case_study(model)
+    if numba_cache:
+        load_module(EXPERIMENTS / "compile_cache.py").enable_numba_cache()
+
+    build_step = functools.partial(module.build_step, trees, particles)
+    base_class = None
+    if dtype is not None:
+        from precision import PrecisionPGBART
+
+        # PyTensor's floatX is set to `dtype` by `in_subprocess`, so the default
+        # dtype of the step is `dtype` too
+        base_class = PrecisionPGBART
+        build_step = functools.partial(build_step, step_class=base_class)
+
+    if phases is not None:
+        from phases import InstrumentedPGBART, timer_cost
+
+        draws = []
+        instrumented = InstrumentedPGBART
+        if base_class is not None:
+            instrumented = type(
+                "InstrumentedPrecisionPGBART", (InstrumentedPGBART, base_class), {}
+            )
+        step_class = functools.partial(
+            instrumented, detail=phases == "detail", callback=draws.append
+        )
+        step = module.build_step(trees, particles, step_class)
+        latencies = sample(step, iters, warmup)
+        steady_mean = float(latencies[warmup:].mean())
+        summary = phase_summary(draws, warmup, steady_mean)
+        # `bookkeeping` is derived, it has no timer of its own
+        timed_calls = sum(
+            values["calls"]
+            for phase, values in summary.items()
+            if phase != "bookkeeping"
+        )
+        return {
+            "phases_steady_mean_s": steady_mean,
+            "phases_overhead": timed_calls * timer_cost() / steady_mean,
+            "phases": summary,
+        }
+
+    if memray_file is not None:
+        import memray
+
+        with memray.Tracker(memray_file, native_traces=False):
+            step = build_step()
+            sample(step, iters, warmup)
+        stats = memray.FileReader(memray_file).metadata
+        return {
+            "total_allocations": int(stats.total_allocations),
+            "peak_heap_mb": stats.peak_memory / 1024**2,
+        }
+
+    start = time.perf_counter()
+    step = build_step()
+    setup = time.perf_counter() - start
+
+    latencies = sample(step, iters, warmup)
+
+    return {
+        "setup_s": setup,
+        # Includes compiling the numba kernels, unless they are cached
+        "first_astep_s": float(latencies[0]),
+        "warmup": latency_summary(latencies[:warmup]),
+        "steady": latency_summary(latencies[warmup:]),
+        "peak_rss_mb": peak_rss_mb(),
+    }
+
+
+def in_subprocess(
+    model,
+    trees,
+    particles,
+    iters,
+    warmup,
+    seed,
+    memray_file=None,
+    phases=None,
+    cache_dir=None,
+    dtype=None,
+):
+    """Run one cell with `bench.py cell` so that timings and RSS are not shared.
+
+    A plain interpreter is used instead of a `multiprocessing` worker: BART keeps its
+    trees in a `multiprocessing.Manager`, which inherits the start method of a worker
+    and would then re-import pymc-bart on the first stored draw.
+
+    With `cache_dir`, PyTensor and numba keep their compilation caches there instead
+    of in their default locations, and the numba kernels of pymc-bart are cached.
+    With `dtype`, PyTensor's floatX and the sampler state use that type.
+    """
+    env = dict(os.environ)
+    pytensor_flags = [env["PYTENSOR_FLAGS"]] if env.get("PYTENSOR_FLAGS") else []
+    with TemporaryDirectory() as tmp:
+        result = Path(tmp, "result.json")
+        command = [
+            sys.executable,
+            __file__,
+            "cell",
+            model,
+            str(trees),
+            str(particles),
+            str(iters),
+            str(warmup),
+            str(seed),
+            str(result),
+        ]
+        if memray_file is not None:
+            command.append(memray_file)
+        if phases is not None:
+            command += ["--phases", phases]
+        if cache_dir is not None:
+            command.append("--numba-cache")
+            pytensor_flags.append(f"compiledir={Path(cache_dir, 'pytensor')}")
+            env["NUMBA_CACHE_DIR"] = str(Path(cache_dir, "numba"))
+        if dtype is not None:
+            command += ["--dtype", dtype]
+            pytensor_flags.append(f"floatX={dtype}")
+        if pytensor_flags:
+            env["PYTENSOR_FLAGS"] = ",".join(pytensor_flags)
+        subprocess.run(command, check=True, env=env)
+        return json.loads(result.read_text())
+
+
+def cell_command(args):
+    result = run_cell(
+        args.model,
+        args.trees,
+        args.particles,
+        args.iters,
+        args.warmup,
+        args.seed,
+        args.memray_file,
+        args.phases,
+        args.numba_cache,
+        args.dtype,
+    )
+    Path(args.result).write_text(json.dumps(result))
+
+
+def git_sha(path):
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"],
+            cwd=path,
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def pymc_bart_info():
+    """Version of pymc-bart and, for installs from git, the commit SHA."""
+    dist = metadata.distribution("pymc-bart")
+    commit = None
+    direct_url = dist.read_text("direct_url.json")
+    if direct_url:
+        commit = json.loads(direct_url).get("vcs_info", {}).get("commit_id")
+    return dist.version, commit
+
+
+def environment():
+    version, commit = pymc_bart_info()
+    key = f"pymc-bart-{version}" + (f"-{commit[:8]}" if commit else "")
+    return {
+        "key": key,
+        "pymc_bart": version,
+        "pymc_bart_commit": commit,
+        "pymc": metadata.version("pymc"),
+        "numpy": np.__version__,
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "processor": platform.processor(),
+        "cpu_count": os.cpu_count(),
+        "benchmark_sha": git_sha(HERE),
+        "timestamp": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+    }
+
+
+def startup(cell_args, dtype=None):
+    """Setup and first iteration times with empty and with filled compilation caches.
+
+    Both runs use a new cache directory, so the result does not depend on what was
+    compiled before on this machine.
+    """
+    # Only the first iterations matter here
+    model, trees, particles, _, _, seed = cell_args
+    times = {}
+    with TemporaryDirectory() as cache_dir:
+        for cache in ["cold", "warm"]:
+            result = in_subprocess(
+                model, trees, particles, 2, 1, seed, cache_dir=cache_dir, dtype=dtype
+            )
+            times[cache] = {
+                "setup_s": result["setup_s"],
+                "first_astep_s": result["first_astep_s"],
+            }
+    return times
+
+
+def run(args):
+    if not 0 <= args.warmup < args.iters:
+        raise ValueError("--warmup must be smaller than --iters")
+
+    env = environment()
+    output = args.output or HERE / "results" / f"{env['key']}.json"
+    output = Path(output)
+    output.parent.mkdir(parents=True, exist_ok=True)
+
+    results = []
+    for model in args.models:
+        for trees in args.trees:
+            for particles in args.particles:
+                cell = {
+                    "model": model,
+                    "trees": trees,
+                    "particles": particles,
+                    "iters": args.iters,
+                    "warmup_iters": args.warmup,
+                    "dtype": args.dtype or "float64",
+                }
+                print(f"{model} | trees: {trees} particles: {particles}", flush=True)
+                cell_args = (
+                    model,
+                    trees,
+                    particles,
+                    args.iters,
+                    args.warmup,
+                    args.seed,
+                )
+                cell.update(in_subprocess(*cell_args, dtype=args.dtype))
+                if args.memray:
+                    # Allocation tracking distorts timings, so it gets its own run
+                    with TemporaryDirectory() as tmp:
+                        capture = str(Path(tmp, "capture.bin"))
+                        cell.update(
+                            in_subprocess(*cell_args, capture, dtype=args.dtype)
+                        )
+                if args.phases:
+                    cell.update(
+                        in_subprocess(*cell_args, phases=args.phases, dtype=args.dtype)
+                    )
+                if args.startup:
+                    cell["startup"] = startup(cell_args, args.dtype)
+                print(
+                    f"  setup: {cell['setup_s']:.2f}s "
+                    f"steady p50: {cell['steady']['p50_s'] * 1e3:.1f}ms "
+                    f"p99: {cell['steady']['p99_s'] * 1e3:.1f}ms "
+                    f"peak RSS: {cell['peak_rss_mb']:.0f}MB",
+                    flush=True,
+                )
+                if args.phases:
+                    print(
+                        "  phases: "
+                        + " ".join(
+                            f"{phase}: {values['share']:.0%}"
+                            for phase, values in cell["phases"].items()
+                        )
+                        + f" timer overhead: {cell['phases_overhead']:.1%}",
+                        flush=True,
+                    )
+                if args.startup:
+                    print(
+                        "  startup: "
+                        + " ".join(
+                            f"{cache}: {values['setup_s'] + values['first_astep_s']:.2f}s"
+                            for cache, values in cell["startup"].items()
+                        ),
+                        flush=True,
+                    )
+                results.append(cell)
+                # Write after every cell, so that an interrupted grid keeps its results
+                output.write_text(json.dumps({**env, "results": results}, indent=2))
+
+    print(f"Results written to {output}")
+
+
+def get_metric(cell, metric):
+    value = cell
+    for key in metric:
+        if value is None or key not in value:
+            return None
+        value = value[key]
+    return value
+
+
+def compare(args):
+    base = json.loads(Path(args.base).read_text())
+    new = json.loads(Path(args.new).read_text())
+
+    def cell_key(cell):
+        # Results written before `--dtype` existed are float64
+        dtype = cell.get("dtype", "float64")
+        return (
+            cell["model"],
+            cell["trees"],
+            cell["particles"],
+            cell["iters"],
+            cell["warmup_iters"],
+            None if args.across_dtypes else dtype,
+        )
+
+    base_cells = {cell_key(cell): cell for cell in base["results"]}
+
+    print(f"base: {base['key']}  new: {new['key']}  threshold: {args.threshold:.0%}")
+    regressions = 0
+    skipped = 0
+    for cell in new["results"]:
+        key = cell_key(cell)
+        if key not in base_cells:
+            skipped += 1
+            continue
+        dtypes = [c.get("dtype", "float64") for c in (base_cells[key], cell)]
+        dtype = dtypes[0] if dtypes[0] == dtypes[1] else " -> ".join(dtypes)
+        print(f"\n{key[0]} | trees: {key[1]} particles: {key[2]} dtype: {dtype}")
+        for metric in METRICS:
+            before = get_metric(base_cells[key], metric)
+            after = get_metric(cell, metric)
+            if not before or after is None:
+                continue
+            change = after / before - 1
+            flag = ""
+            if change > args.threshold:
+                flag = "REGRESSION"
+                regressions += 1
+            elif change < -args.threshold:
+                flag = "improvement"
+            name = ".".join(metric)
+            print(f"  {name:<20} {before:>12.4g} {after:>12.4g} {change:>+8.1%} {flag}")
+
+    if skipped:
+        print(
+            f"\n{skipped} cell(s) of {args.new} have no match in {args.base}"
+            + ("" if args.across_dtypes else " with the same dtype")
+        )
+    print(f"\n{regressions} regression(s) beyond {args.threshold:.0%}")
+    return 1 if regressions else 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    run_parser = subparsers.add_parser("run", help="Run the benchmark grid")
+    run_parser.add_argument("--models", nargs="+", default=MODELS, choices=MODELS)
+    run_parser.add_argument("--trees", nargs="+", type=int, default=[50, 100, 200])
+    run_parser.add_argument("--particles", nargs="+", type=int, default=[20, 40, 60])
+    run_parser.add_argument(
+        "--iters", type=int, default=500, help="Number of iterations, including warmup"
+    )
+    run_parser.add_argument(
+        "--warmup", type=int, default=100, help="Number of tuning iterations"
+    )
+    run_parser.add_argument("--seed", type=int, default=0)
+    run_parser.add_argument(
+        "--memray", action="store_true", help="Also record allocations with memray"
+    )
+    run_parser.add_argument(
+        "--phases",
+        choices=["coarse", "detail"],
+        help="Also time the phases of astep, see phases.py",
+    )
+    run_parser.add_argument(
+        "--startup",
+        action="store_true",
+        help="Also time the startup with cold and warm compilation caches",
+    )
+    run_parser.add_argument(
+        "--dtype",
+        choices=["float64", "float32"],
+        help="Floating-point type of PyTensor and of the sampler state, see precision.py",
+    )
+    run_parser.add_argument("--output", help="Defaults to results/<key>.json")
+    run_parser.set_defaults(func=run)
+
+    compare_parser = subparsers.add_parser("compare", help="Compare two result files")
+    compare_parser.add_argument("base")
+    compare_parser.add_argument("new")
+    compare_parser.add_argument(
+        "--threshold", type=float, default=0.1, help="Relative change flagged"
+    )
+    compare_parser.add_argument(
+        "--across-dtypes",
+        action="store_true",
+        help="Also match cells run with different dtypes, e.g. float32 against float64",
+    )
+    compare_parser.set_defaults(func=compare)
+
+    # Used by `run` to execute each cell in a fresh interpreter
+    cell_parser = subparsers.add_parser("cell")
+    cell_parser.add_argument("model", choices=MODELS)
+    for name in ["trees", "particles", "iters", "warmup", "seed"]:
+        cell_parser.add_argument(name, type=int)
+    cell_parser.add_argument("result")
+    cell_parser.add_argument("memray_file", nargs="?")
+    cell_parser.add_argument("--phases", choices=["coarse", "detail"])
+    cell_parser.add_argument("--numba-cache", action="store_true")
+    cell_parser.add_argument("--dtype", choices=["float64", "float32"])
+    cell_parser.set_defaults(func=cell_command)
+
+    args = parser.parse_args()
+    return args.func(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,195 @@
+"""Low-overhead phase timers for the PGBART sampler.
+
+`InstrumentedPGBART` is a drop-in replacement of `pymc_bart.PGBART` that measures how
+long each draw spends in every phase of `astep`, without `@profile` decorators:
+
+    step = InstrumentedPGBART([μ], num_particles=20)
+    idata = pm.sample(step=[step])
+    idata.sample_stats["time_sample_tree"]
+
+The phases partition `astep`, so they add up to the time of the draw:
+
+* ``init_particles``: copy the old tree and create the particles, including the
+  weight of the old tree.
+* ``sample_tree``: grow the particles.
+* ``update_weight``: weight the particles that grew.
+* ``resample``: resample the particles after every growth round.
+* ``bookkeeping``: everything else, i.e. normalizing the weights, picking the new tree,
+  updating the sum of trees, trimming and storing the tree, and the tuning updates.
+
+With ``detail=True``, the functions called inside those phases are also timed:
+``grow_tree`` and ``draw_leaf_value`` (inside ``sample_tree``), ``likelihood_logp``
+(inside ``update_weight`` and ``init_particles``) and ``systematic`` (inside
+``resample``, and once per tree inside ``bookkeeping``). They are called far more often, so their timers cost more.
+
+For every draw, the time in seconds (``time_<phase>``) and the number of calls
+(``calls_<phase>``) of each phase are returned as sample stats, next to
+``variable_inclusion``, and passed to `callback` if given. `totals` accumulates them
+over all the draws made in the current process, i.e. not when `pm.sample` runs the
+chains in worker processes.
+"""
+
+from time import perf_counter_ns
+
+import numpy as np
+import pymc_bart.pgbart as pgbart
+
+PHASES = ["init_particles", "sample_tree", "update_weight", "resample", "bookkeeping"]
+DETAIL_PHASES = ["grow_tree", "draw_leaf_value", "likelihood_logp", "systematic"]
+
+
+def timed(counter, func):
+    """Wrap `func` to add its elapsed nanoseconds and calls to `counter`."""
+
+    def wrapper(*args, **kwargs):
+        start = perf_counter_ns()
+        result = func(*args, **kwargs)
+        counter[0] += perf_counter_ns() - start
+        counter[1] += 1
+        return result
+
+    return wrapper
+
+
+def timer_cost(calls=100_000):
+    """Seconds added to every timed call, measured on a function that does nothing.
+
+    Multiplied by the calls of a draw, it estimates the overhead of the timers without
+    comparing two runs, whose difference is usually larger than the overhead itself.
+    """
+
+    def noop(*args):
+        return None
+
+    wrapper = timed([0, 0], noop)
+    args = tuple(range(11))  # as many arguments as `sample_tree`
+    start = perf_counter_ns()
+    for _ in range(calls):
+        noop(*args)
+    plain = perf_counter_ns() - start
+    start = perf_counter_ns()
+    for _ in range(calls):
+        wrapper(*args)
+    return max(perf_counter_ns() - start - plain, 0) * 1e-9 / calls
+
+
+class InstrumentedPGBART(pgbart.PGBART):
+    """PGBART step that records the time spent in each phase of `astep`.
+
+    Parameters
+    ----------
+    detail : bool
+        Also time the functions called inside the phases. Defaults to False.
+    callback : callable, optional
+        Called after every draw with a dict of the stats of the draw.
+
+    The remaining parameters are passed to `pymc_bart.PGBART`.
+    """
+
+    def __init__(
+        self,
+        vars=None,  # pylint: disable=redefined-builtin
+        num_particles=10,
+        batch=(0.1, 0.1),
+        model=None,
+        detail=False,
+        callback=None,
+    ):
+        super().__init__(vars, num_particles, batch, model)
+        self.detail = detail
+        self.callback = callback
+        self.phases = PHASES + (DETAIL_PHASES if detail else [])
+        # [nanoseconds, calls] of each phase in the current draw
+        self._counters = {phase: [0, 0] for phase in self.phases}
+        self._in_init = False
+        self.totals = {f"time_{phase}": 0.0 for phase in self.phases}
+        self.totals.update({f"calls_{phase}": 0 for phase in self.phases})
+
+        new_stats = {}
+        for phase in self.phases:
+            new_stats[f"time_{phase}"] = (np.float64, [])
+            new_stats[f"calls_{phase}"] = (np.int64, [])
+        self.stats_dtypes = [
+            {**self.stats_dtypes[0], **{k: v[0] for k, v in new_stats.items()}}
+        ]
+        self.stats_dtypes_shapes = {**self.stats_dtypes_shapes, **new_stats}
+
+    def astep(self, q):
+        for counter in self._counters.values():
+            counter[0] = counter[1] = 0
+
+        # `sample_tree` is a method of the particles, `grow_tree` and `draw_leaf_value`
+        # are module globals and `likelihood_logp` is the compiled function set by
+        # `PGBART.__init__`, so they are replaced only while this step is running
+        patches = [(pgbart.ParticleTree, "sample_tree")]
+        if self.detail:
+            patches += [
+                (pgbart, "grow_tree"),
+                (pgbart, "draw_leaf_value"),
+                (self, "likelihood_logp"),
+            ]
+        originals = [getattr(owner, name) for owner, name in patches]
+        for (owner, name), original in zip(patches, originals):
+            setattr(owner, name, timed(self._counters[name], original))
+        try:
+            start = perf_counter_ns()
+            sum_trees, [stats] = super().astep(q)
+            elapsed = perf_counter_ns() - start
+        finally:
+            for (owner, name), original in zip(patches, originals):
+                setattr(owner, name, original)
+
+        counters = self._counters
+        counters["bookkeeping"][0] = elapsed - sum(
+            counters[phase][0] for phase in PHASES[:-1]
+        )
+        counters["bookkeeping"][1] = 1
+        for phase, (nanoseconds, calls) in counters.items():
+            stats[f"time_{phase}"] = nanoseconds * 1e-9
+            stats[f"calls_{phase}"] = calls
+            self.totals[f"time_{phase}"] += nanoseconds * 1e-9
+            self.totals[f"calls_{phase}"] += calls
+
+        if self.callback is not None:
+            self.callback(stats)
+        return sum_trees, [stats]
+
+    def init_particles(self, tree_id, odim):
+        start = perf_counter_ns()
+        self._in_init = True
+        try:
+            particles = super().init_particles(tree_id, odim)
+        finally:
+            self._in_init = False
+        counter = self._counters["init_particles"]
+        counter[0] += perf_counter_ns() - start
+        counter[1] += 1
+        return particles
+
+    def update_weight(self, particle, odim):
+        if self._in_init:
+            # Counted in `init_particles`, so that the phases do not overlap
+            return super().update_weight(particle, odim)
+        start = perf_counter_ns()
+        super().update_weight(particle, odim)
+        counter = self._counters["update_weight"]
+        counter[0] += perf_counter_ns() - start
+        counter[1] += 1
+
+    def resample(self, particles, normalized_weights):
+        start = perf_counter_ns()
+        particles = super().resample(particles, normalized_weights)
+        counter = self._counters["resample"]
+        counter[0] += perf_counter_ns() - start
+        counter[1] += 1
+        return particles
+
+    def systematic(self, normalized_weights):
+        if not self.detail:
+            return super().systematic(normalized_weights)
+        start = perf_counter_ns()
+        indices = super().systematic(normalized_weights)
+        counter = self._counters["systematic"]
+        counter[0] += perf_counter_ns() - start
+        counter[1] += 1
+        return indices
@@ -0,0 +1,99 @@
+"""PGBART with its sampler state in a configurable floating-point precision.
+
+PyMC-BART allocates `sum_trees` and the outputs of the trees with PyTensor's
+``floatX``, but keeps `X`, the leaf values and the split values in float64, and
+`update_weight` promotes the sum of trees to float64 before calling the likelihood.
+With ``PYTENSOR_FLAGS=floatX=float32``, the likelihood is compiled for float32 and
+that call fails, so PyMC-BART 0.5.12 cannot sample in single precision.
+
+`PrecisionPGBART` is a drop-in replacement of `pymc_bart.PGBART` that keeps the sum
+of trees, the tree outputs, the leaf values (and the parameters of linear leaves) in
+`dtype`, so the particles and the stored posterior trees use it too:
+
+    step = PrecisionPGBART([μ], num_particles=20, dtype="float32")
+
+The likelihood keeps the dtype it was compiled with, which is ``floatX`` when the
+model was built. When it differs from `dtype`, the sum of trees is converted before
+every call: with float32 state and a float64 likelihood, the sum-of-trees arrays are
+halved while the log-weights are still accumulated in double precision.
+
+`X`, and so the split values drawn from it, stay in the dtype of the BART variable's
+`X`. The stored trees are predicted on that `X` by `_sample_posterior` and the
+experiments, so splitting on a rounded copy would send the rows close to a split value
+to the other child than the one they went to while sampling.
+"""
+
+import numpy as np
+import pymc_bart.pgbart as pgbart
+from pytensor import config
+
+
+class PrecisionPGBART(pgbart.PGBART):
+    """PGBART step whose sampler state uses the floating-point type `dtype`.
+
+    Parameters
+    ----------
+    dtype : str, optional
+        Floating-point type of the sampler state. Defaults to ``pytensor.config.floatX``.
+
+    The remaining parameters are passed to `pymc_bart.PGBART`.
+    """
+
+    def __init__(
+        self,
+        vars=None,  # pylint: disable=redefined-builtin
+        num_particles=10,
+        batch=(0.1, 0.1),
+        model=None,
+        dtype=None,
+    ):
+        super().__init__(vars, num_particles, batch, model)
+        self.dtype = np.dtype(dtype or config.floatX)
+        self.logp_dtype = np.dtype(
+            self.likelihood_logp.maker.fgraph.inputs[0].type.dtype
+        )
+
+        self.sum_trees = self.sum_trees.astype(self.dtype)
+        self.sum_trees_noi = self.sum_trees_noi.astype(self.dtype)
+        self.a_tree.output = self.a_tree.output.astype(self.dtype)
+        for node in self.a_tree.tree_structure.values():
+            node.value = np.asarray(node.value).astype(self.dtype)
+        # The particles share the output array of the tree they are copied from
+        self.all_particles = [
+            [pgbart.ParticleTree(self.a_tree) for _ in range(self.m)]
+            for _ in range(self.trees_shape)
+        ]
+        self.all_trees = np.array(
+            [[p.tree for p in particles] for particles in self.all_particles]
+        )
+
+    def astep(self, q):
+        # `draw_leaf_value` is a module global of `pgbart`, called by `grow_tree`, so
+        # it is replaced only while this step is running
+        original = pgbart.draw_leaf_value
+        pgbart.draw_leaf_value = self._draw_leaf_value(original)
+        try:
+            sum_trees, stats = super().astep(q)
+        finally:
+            pgbart.draw_leaf_value = original
+        return sum_trees.astype(self.logp_dtype, copy=False), stats
+
+    def _draw_leaf_value(self, draw_leaf_value):
+        dtype = self.dtype
+
+        def wrapper(*args, **kwargs):
+            value, linear_params = draw_leaf_value(*args, **kwargs)
+            if linear_params is not None:
+                linear_params = [np.asarray(p).astype(dtype) for p in linear_params]
+            return np.asarray(value).astype(dtype), linear_params
+
+        return wrapper
+
+    def update_weight(self, particle, odim):
+        # Only the sum of trees of `odim` changes, so there is no need to multiply the
+        # prediction by a row of the identity matrix as `PGBART.update_weight` does
+        sum_trees = self.sum_trees_noi.copy()
+        sum_trees[odim] += particle.tree._predict()
+        particle.log_weight = self.likelihood_logp(
+            sum_trees.ravel().astype(self.logp_dtype, copy=False)
+        )
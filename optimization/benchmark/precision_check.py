@@ -0,0 +1,207 @@
+"""Accuracy of the PGBART sampler in single precision against double precision.
+
+Every case study is sampled with `PrecisionPGBART` in four configurations, each in its
+own Python process since PyTensor's floatX cannot change after it is imported:
+
+* ``float64``: the reference, i.e. what `pmb.PGBART` does;
+* ``float64 (seed + 1)``: the same data with another seed for the sampler, which
+  measures the Monte Carlo error that any other configuration is compared to;
+* ``float32 state``: the sum of trees and the leaf values in float32, with the
+  likelihood still compiled for float64;
+* ``float32``: the same plus ``floatX=float32``, so the likelihood is float32 too.
+
+    python precision_check.py --models biking coal --trees 50 --particles 20
+
+For each configuration, it prints the difference between its posterior mean of the
+BART variable and the one of the reference, as the root mean square over the
+observations of the difference in units of the reference posterior standard
+deviation, together with the mean `astep` time, the memory of the sampler state and
+the pickled size of the trees stored for one draw. It also predicts the trees stored
+for the last draw on the `X` of the BART variable and prints their largest difference
+from the sampled sum of trees, in the same units: anything above rounding error means
+that predictions from the posterior trees do not match the posterior of the variable.
+"""
+
+import argparse
+import functools
+import json
+import os
+import pickle
+import subprocess
+import sys
+import time
+
+from pathlib import Path
+from tempfile import TemporaryDirectory
+
+import numpy as np
+
+from bench import MODELS, load_case_study
+
+# (name, dtype of the state, floatX, seed offset)
+CONFIGS = [
+    ("float64", "float64", "float64", 0),
+    ("float64 (seed + 1)", "float64", "float64", 1),
+    ("float32 state", "float32", "float64", 0),
+    ("float32", "float32", "float32", 0),
+]
+
+
+def run_cell(model, trees, particles, iters, warmup, seed, sampler_seed, dtype):
+    """Sample one case study and summarize the draws after tuning."""
+    from precision import PrecisionPGBART
+
+    # Some case studies simulate their data, which must not change with the seed
+    np.random.seed(seed)
+    module = load_case_study(model)
+    step = module.build_step(
+        trees, particles, functools.partial(PrecisionPGBART, dtype=dtype)
+    )
+    np.random.seed(sampler_seed)
+
+    total = total_sq = 0
+    latencies = []
+    for i in range(iters):
+        if i == warmup:
+            step.stop_tuning()
+        start = time.perf_counter()
+        sum_trees, _ = step.astep(i)
+        latencies.append(time.perf_counter() - start)
+        if i >= warmup:
+            draw = sum_trees.astype(float)
+            total = total + draw
+            total_sq = total_sq + draw**2
+
+    draws = iters - warmup
+    mean = total / draws
+    sd = np.sqrt(np.maximum(total_sq / draws - mean**2, 0))
+    # The stored trees must reproduce the last draw on the `X` of the BART variable,
+    # which is what the predictions from the posterior trees use
+    stored = np.stack(
+        [
+            sum(tree.predict(x=step.X, shape=step.leaves_shape) for tree in odim_trees)
+            for odim_trees in step.bart.all_trees[-1]
+        ]
+    ).reshape(sum_trees.shape)
+    trees_diff = np.abs(stored - sum_trees) / np.where(sd > 0, sd, 1)
+    return {
+        "mean": mean.tolist(),
+        "sd": sd.tolist(),
+        "trees_diff_sd": float(trees_diff.max()),
+        "astep_s": float(np.mean(latencies[warmup:])),
+        "state_mb": (step.X.nbytes + step.sum_trees.nbytes + step.sum_trees_noi.nbytes)
+        / 1024**2,
+        "stored_kb": len(pickle.dumps(step.bart.all_trees[-1])) / 1024,
+    }
+
+
+def in_subprocess(
+    model, trees, particles, iters, warmup, seed, sampler_seed, dtype, float_x
+):
+    with TemporaryDirectory() as tmp:
+        result = Path(tmp, "result.json")
+        command = [
+            sys.executable,
+            __file__,
+            "cell",
+            model,
+            str(trees),
+            str(particles),
+            str(iters),
+            str(warmup),
+            str(seed),
+            str(sampler_seed),
+            dtype,
+            str(result),
+        ]
+        flags = (
+            [os.environ["PYTENSOR_FLAGS"]] if os.environ.get("PYTENSOR_FLAGS") else []
+        )
+        env = {**os.environ, "PYTENSOR_FLAGS": ",".join(flags + [f"floatX={float_x}"])}
+        subprocess.run(command, check=True, env=env)
+        return json.loads(result.read_text())
+
+
+def check(args):
+    results = {}
+    for model in args.models:
+        print(f"{model} | trees: {args.trees} particles: {args.particles}", flush=True)
+        runs = {}
+        for name, dtype, float_x, offset in CONFIGS:
+            runs[name] = in_subprocess(
+                model,
+                args.trees,
+                args.particles,
+                args.iters,
+                args.warmup,
+                args.seed,
+                args.seed + offset,
+                dtype,
+                float_x,
+            )
+        reference = runs["float64"]
+        ref_mean, ref_sd = np.array(reference["mean"]), np.array(reference["sd"])
+        for name, run in runs.items():
+            diff = (np.array(run["mean"]) - ref_mean) / np.where(ref_sd > 0, ref_sd, 1)
+            run["mean_diff_sd"] = float(np.sqrt(np.mean(diff**2)))
+            print(
+                f"  {name:<20} mean diff: {run['mean_diff_sd']:.3f} sd "
+                f"astep: {run['astep_s'] * 1e3:.1f}ms "
+                f"state: {run['state_mb']:.3f}MB "
+                f"stored trees: {run['stored_kb']:.1f}KB "
+                f"(max diff: {run['trees_diff_sd']:.1e} sd)",
+                flush=True,
+            )
+            del run["mean"], run["sd"]
+        results[model] = runs
+
+    if args.output:
+        Path(args.output).write_text(json.dumps(results, indent=2))
+
+
+def cell_command(args):
+    result = run_cell(
+        args.model,
+        args.trees,
+        args.particles,
+        args.iters,
+        args.warmup,
+        args.seed,
+        args.sampler_seed,
+        args.dtype,
+    )
+    Path(args.result).write_text(json.dumps(result))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    subparsers = parser.add_subparsers(dest="command")
+
+    parser.add_argument("--models", nargs="+", default=MODELS, choices=MODELS)
+    parser.add_argument("--trees", type=int, default=50)
+    parser.add_argument("--particles", type=int, default=20)
+    parser.add_argument(
+        "--iters", type=int, default=1500, help="Number of iterations, including warmup"
+    )
+    parser.add_argument(
+        "--warmup", type=int, default=500, help="Number of tuning iterations"
+    )
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="Also write the results as JSON")
+    parser.set_defaults(func=check)
+
+    # Used to run each configuration in a fresh interpreter
+    cell_parser = subparsers.add_parser("cell")
+    cell_parser.add_argument("model", choices=MODELS)
+    for name in ["trees", "particles", "iters", "warmup", "seed", "sampler_seed"]:
+        cell_parser.add_argument(name, type=int)
+    cell_parser.add_argument("dtype", choices=["float64", "float32"])
+    cell_parser.add_argument("result")
+    cell_parser.set_defaults(func=cell_command)
+
+    args = parser.parse_args()
+    return args.func(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -9,9 +9,11 @@ import pandas as pd
 import pymc as pm
 import pymc_bart as pmb
 
+DATA = Path(__file__).resolve().parents[2] / "experiments"
 
-def main(args):
-    bikes = pd.read_csv(Path("../..", "experiments", "bikes.csv"))
+
+def build_step(trees, particle, step_class=pmb.PGBART):
+    bikes = pd.read_csv(DATA / "bikes.csv")
 
     X = bikes[["hour", "temperature", "humidity", "windspeed"]]
     Y = bikes["count"]
@@ -19,12 +21,18 @@ def main(args):
     try:
         with pm.Model() as model:
             σ = pm.HalfNormal("σ", Y.std())
-            μ = pmb.BART("μ", X, Y, m=args.trees)
+            μ = pmb.BART("μ", X, Y, m=trees)
             y = pm.Normal("y", μ, σ, observed=Y)
-            step = pmb.PGBART([μ], num_particles=args.particle)
+            step = step_class([μ], num_particles=particle)
     except Exception as e:
         raise RuntimeError("Issue running model") from e
-    
+
+    return step
+
+
+def main(args):
+    step = build_step(args.trees, args.particle)
+
     for iter in range(args.iters):
         step.astep(iter)
 
@@ -35,4 +43,4 @@ if __name__ == "__main__":
     parser.add_argument("--particle", type=int, default=20, help="Number of particles")
     parser.add_argument("--iters", type=int, default=1000, help="Number of iterations")
     args = parser.parse_args()
-    main(args)
\ No newline at end of file
+    main(args)
@@ -9,9 +9,11 @@ import numpy as np
 import pymc as pm
 import pymc_bart as pmb
 
+DATA = Path(__file__).resolve().parents[2] / "experiments"
 
-def main(args):
-    coal = np.loadtxt(Path("../..", "experiments", "coal.csv").resolve())
+
+def build_step(trees, particle, step_class=pmb.PGBART):
+    coal = np.loadtxt(DATA / "coal.csv")
 
     # Discretize data
     years = int(coal.max() - coal.min())
@@ -26,16 +28,23 @@ def main(args):
 
     try:
         with pm.Model() as model_coal:
-            μ_ = pmb.BART("μ_", X=x_data, Y=y_data, m=args.trees)
+            μ_ = pmb.BART("μ_", X=x_data, Y=y_data, m=trees)
             μ = pm.Deterministic("μ", np.abs(μ_))
             y_pred = pm.Poisson("y_pred", mu=μ, observed=y_data)
-            step = pmb.PGBART([μ_], num_particles=args.particle)
+            step = step_class([μ_], num_particles=particle)
     except Exception as e:
         raise RuntimeError("Issue running model") from e
 
+    return step
+
+
+def main(args):
+    step = build_step(args.trees, args.particle)
+
     for iter in range(args.iters):
         step.astep(iter)
 
+
 if __name__ == "__main__":
     parser = argparse.ArgumentParser()
     parser.add_argument("--trees", type=int, default=50, help="Number of trees")
@@ -8,8 +8,7 @@ import pymc as pm
 import pymc_bart as pmb
 
 
-def main(args):
-
+def build_step(trees, particle, step_class=pmb.PGBART):
     X = np.random.uniform(low=0, high=1.0, size=(100, 5))
     f_x = (
         10 * np.sin(np.pi * X[:, 0] * X[:, 1])
@@ -21,20 +20,27 @@ def main(args):
 
     try:
         with pm.Model() as model:
-            μ = pmb.BART("μ", X, Y, m=args.trees)
+            μ = pmb.BART("μ", X, Y, m=trees)
             σ = pm.HalfNormal("σ", 1)
             y = pm.Normal("y", mu=μ, sigma=σ, observed=Y)
-            step = pmb.PGBART([μ], num_particles=args.particle)
+            step = step_class([μ], num_particles=particle)
     except Exception as e:
         raise RuntimeError("Issue running model") from e
 
+    return step
+
+
+def main(args):
+    step = build_step(args.trees, args.particle)
+
     for iter in range(args.iters):
         step.astep(iter)
 
+
 if __name__ == "__main__":
     parser = argparse.ArgumentParser()
     parser.add_argument("--trees", type=int, default=50, help="Number of trees")
     parser.add_argument("--particle", type=int, default=20, help="Number of particles")
     parser.add_argument("--iters", type=int, default=1000, help="Number of iterations")
     args = parser.parse_args()
-    main(args)
\ No newline at end of file
+    main(args)
@@ -9,30 +9,34 @@ from pathlib import Path
 
 import pymc_bart as pmb
 
+DATA = Path(__file__).resolve().parents[2] / "experiments"
 
-def main(args):
 
-    sin = np.loadtxt(
-        Path("../..",  "experiments", "space_influenza.csv"), 
-        skiprows=1, 
-        delimiter=","
-    )
+def build_step(trees, particle, step_class=pmb.PGBART):
+    sin = np.loadtxt(DATA / "space_influenza.csv", skiprows=1, delimiter=",")
     X = sin[:, 1][:, None]
     Y = sin[:, 2]
 
     try:
         with pm.Model() as model:
-            μ = pmb.BART("μ", X, Y, m=args.trees)
+            μ = pmb.BART("μ", X, Y, m=trees)
             p = pm.Deterministic("p", pm.math.sigmoid(μ))
             y = pm.Bernoulli("y", p=p, observed=Y)
-            step = pmb.PGBART([μ], num_particles=args.particle)
+            step = step_class([μ], num_particles=particle)
 
     except Exception as e:
         raise RuntimeError("Issue running model") from e
-    
+
+    return step
+
+
+def main(args):
+    step = build_step(args.trees, args.particle)
+
     for iter in range(args.iters):
         step.astep(iter)
 
+
 if __name__ == "__main__":
     parser = argparse.ArgumentParser()
     parser.add_argument("--trees", type=int, default=50, help="Number of trees")
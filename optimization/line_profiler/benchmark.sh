@@ -22,8 +22,10 @@ function profile() {
     fi
 
     program="$BASE/bart_case_$1.py"
+    SECONDS=0
     kernprof -l -o "$output" $program --trees $2 --particle $3 --iters $4
     exit_status=$?
+    elapsedSeconds=$SECONDS
     
     if [ $exit_status -eq 0 ]; then
         e_success "profile | t:$2 p:$3 i:$4 $output elapsed: $(textifyDuration $elapsedSeconds)"
@@ -0,0 +1,301 @@
+"""Aggregated call-tree report of the line_profiler and memray results.
+
+Load every `.lprof` file and memray capture produced by the `benchmark.sh` scripts,
+build the `astep` call tree of each (model, trees, particles) cell with the time and
+allocation share of every node, and fit how each node scales with trees and particles:
+
+    python report.py --lprof ../line_profiler/results --memray ../memray/results
+"""
+
+import argparse
+import json
+import re
+import sys
+
+from collections import defaultdict
+from pathlib import Path
+
+import numpy as np
+
+# Functions profiled in `optimization/line_profiler` and their callees. `logp` is also
+# profiled, but it compiles the likelihood once when the step is created and it is not
+# called from `astep`, where `update_weight` calls the compiled function instead.
+# `systematic` is also called by `get_particle_tree`, so it can exceed `resample`.
+CALL_TREE = {
+    "astep": ["sample_tree", "update_weight", "resample"],
+    "sample_tree": ["grow_tree"],
+    "grow_tree": ["draw_leaf_value"],
+    "resample": ["systematic"],
+}
+ROOT = "astep"
+PARENT = {child: parent for parent, children in CALL_TREE.items() for child in children}
+# Depth-first order, as the nodes are printed
+NODES = [
+    "astep",
+    "sample_tree",
+    "grow_tree",
+    "draw_leaf_value",
+    "update_weight",
+    "resample",
+    "systematic",
+]
+# Only frames from pymc-bart are attributed, e.g. `pymc.logp` is not `pgbart.logp`
+PACKAGE = "pymc_bart"
+RESULT_NAME = re.compile(r"^(?P<model>.+)_(?P<trees>\d+)_(?P<particles>\d+)(\.lprof)?$")
+
+
+def parse_cell(path):
+    """(model, trees, particles) from a result file named `<model>_<trees>_<particles>`."""
+    match = RESULT_NAME.match(path.name)
+    if match is None:
+        return None
+    return match["model"], int(match["trees"]), int(match["particles"])
+
+
+def node_name(function):
+    """Call-tree node of a (possibly qualified) function name, e.g. `PGBART.astep`."""
+    name = function.rsplit(".", 1)[-1]
+    return name if name in PARENT or name == ROOT else None
+
+
+def load_lprof(path):
+    """Total time in seconds and number of calls of each call-tree node."""
+    from line_profiler import load_stats
+
+    stats = load_stats(str(path))
+    nodes = {}
+    for (filename, _, function), timings in stats.timings.items():
+        name = node_name(function)
+        if name is None or PACKAGE not in filename or not timings:
+            continue
+        # Line times include the time spent in callees, so the sum is inclusive
+        first_line = min(timings)
+        nodes[name] = {
+            "time_s": sum(time for _, _, time in timings) * stats.unit,
+            "calls": first_line[1],
+        }
+    return nodes
+
+
+def load_memray(path):
+    """Bytes and number of allocations made inside each call-tree node.
+
+    An allocation counts towards every node in its stack, so the values are inclusive
+    like the line_profiler times.
+    """
+    from memray import AllocatorType, FileReader
+
+    deallocators = {
+        AllocatorType.FREE,
+        AllocatorType.PYMALLOC_FREE,
+        AllocatorType.MUNMAP,
+    }
+    reader = FileReader(str(path))
+    try:
+        records = reader.get_allocation_records()
+    except NotImplementedError:
+        # Captures written with `--aggregate` only keep the high watermark
+        records = reader.get_high_watermark_allocation_records()
+
+    nodes = defaultdict(lambda: {"bytes": 0, "allocations": 0})
+    total = {"bytes": 0, "allocations": 0}
+    stack_nodes = {}
+    for record in records:
+        if record.allocator in deallocators:
+            continue
+        total["bytes"] += record.size
+        total["allocations"] += record.n_allocations
+        key = (record.tid, record.stack_id)
+        if key not in stack_nodes:
+            stack_nodes[key] = {
+                node_name(function)
+                for function, filename, _ in record.stack_trace()
+                if PACKAGE in filename
+            } - {None}
+        for name in stack_nodes[key]:
+            nodes[name]["bytes"] += record.size
+            nodes[name]["allocations"] += record.n_allocations
+    return dict(nodes), total
+
+
+def collect(lprof_dir, memray_dir):
+    """Results of every cell, keyed by (model, trees, particles)."""
+    cells = defaultdict(dict)
+    if lprof_dir is not None:
+        for path in sorted(Path(lprof_dir).glob("*.lprof")):
+            cell = parse_cell(path)
+            if cell is not None:
+                cells[cell]["time"] = load_lprof(path)
+    if memray_dir is not None:
+        for path in sorted(Path(memray_dir).iterdir()):
+            cell = parse_cell(path)
+            if cell is not None and path.suffix == "":
+                cells[cell]["memory"], cells[cell]["memory_total"] = load_memray(path)
+    return dict(sorted(cells.items()))
+
+
+def shares(nodes, metric):
+    """Share of each node relative to its parent and to the root."""
+    root = nodes.get(ROOT, {}).get(metric)
+    result = {}
+    for name in NODES:
+        value = nodes.get(name, {}).get(metric)
+        if value is None:
+            continue
+        parent = nodes.get(PARENT.get(name), {}).get(metric)
+        result[name] = {
+            "parent": value / parent if parent else None,
+            "astep": value / root if root else None,
+        }
+    return result
+
+
+def fit_scaling(cells, metric, source):
+    """Fit `metric ~ trees^a * particles^b` per model and node with least squares.
+
+    Only models with at least three cells that span both trees and particles are
+    fitted. Returns {model: {node: {"trees": a, "particles": b}}}.
+    """
+    by_model = defaultdict(list)
+    for (model, trees, particles), result in cells.items():
+        if source in result:
+            by_model[model].append((trees, particles, result[source]))
+
+    fits = {}
+    for model, rows in by_model.items():
+        trees = np.array([row[0] for row in rows], dtype=float)
+        particles = np.array([row[1] for row in rows], dtype=float)
+        if len(rows) < 3 or len(set(trees)) < 2 or len(set(particles)) < 2:
+            continue
+        fits[model] = {}
+        for name in NODES:
+            values = np.array([row[2].get(name, {}).get(metric, 0.0) for row in rows])
+            if np.any(values <= 0):
+                continue
+            design = np.column_stack(
+                [np.ones_like(trees), np.log(trees), np.log(particles)]
+            )
+            coef, *_ = np.linalg.lstsq(design, np.log(values), rcond=None)
+            fits[model][name] = {"trees": float(coef[1]), "particles": float(coef[2])}
+    return fits
+
+
+def format_share(share):
+    return "    -" if share is None else f"{share:>5.0%}"
+
+
+def print_tree(nodes, metric, unit, scale, fmt=".2f"):
+    node_shares = shares(nodes, metric)
+
+    def visit(name, prefix, last, depth):
+        if name not in node_shares:
+            return
+        branch = "" if depth == 0 else ("└── " if last else "├── ")
+        label = f"{prefix}{branch}{name}"
+        value = nodes[name][metric] * scale
+        share = node_shares[name]
+        print(
+            f"  {label:<32} {value:>12{fmt}} {unit:<6}"
+            f" {format_share(share['parent'])} of parent"
+            f" {format_share(share['astep'])} of astep"
+        )
+        children = [child for child in CALL_TREE.get(name, []) if child in node_shares]
+        extension = "" if depth == 0 else ("    " if last else "│   ")
+        for i, child in enumerate(children):
+            visit(child, prefix + extension, i == len(children) - 1, depth + 1)
+
+    visit(ROOT, "", True, 0)
+
+
+def print_mean_shares(cells, source, metric):
+    """Mean share of astep of each node across all cells."""
+    values = defaultdict(list)
+    for result in cells.values():
+        if source not in result:
+            continue
+        for name, share in shares(result[source], metric).items():
+            if share["astep"] is not None:
+                values[name].append(share["astep"])
+    for name in NODES:
+        if values[name]:
+            share = np.array(values[name])
+            print(
+                f"  {name:<16} mean {share.mean():>5.0%}"
+                f"  min {share.min():>5.0%}  max {share.max():>5.0%}"
+            )
+
+
+def print_scaling(fits):
+    for model, nodes in fits.items():
+        print(f"  {model}")
+        for name, exponents in nodes.items():
+            print(
+                f"    {name:<16} trees^{exponents['trees']:.2f}"
+                f"  particles^{exponents['particles']:.2f}"
+            )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--lprof", help="Directory with the line_profiler results")
+    parser.add_argument("--memray", help="Directory with the memray captures")
+    parser.add_argument("--json", help="Also write the report to this file")
+    args = parser.parse_args()
+    if args.lprof is None and args.memray is None:
+        parser.error("at least one of --lprof or --memray is required")
+
+    cells = collect(args.lprof, args.memray)
+    if not cells:
+        print("No result files found")
+        return 1
+
+    for (model, trees, particles), result in cells.items():
+        print(f"\n{model} | trees: {trees} particles: {particles}")
+        if "time" in result:
+            print(" time")
+            print_tree(result["time"], "time_s", "s", 1)
+        if "memory" in result:
+            total = result["memory_total"]
+            print(
+                f" memory (whole run: {total['bytes'] / 1024**2:.0f} MB"
+                f" in {total['allocations']:,} allocations)"
+            )
+            print_tree(result["memory"], "bytes", "MB", 1 / 1024**2)
+            print_tree(result["memory"], "allocations", "allocs", 1, ",.0f")
+
+    summaries = [
+        ("time", "time_s", "Time"),
+        ("memory", "bytes", "Allocated bytes"),
+        ("memory", "allocations", "Allocations"),
+    ]
+    scaling = {}
+    for source, metric, title in summaries:
+        count = sum(source in result for result in cells.values())
+        if not count:
+            continue
+        print(f"\n{title}: share of astep across {count} cells")
+        print_mean_shares(cells, source, metric)
+        scaling[metric] = fit_scaling(cells, metric, source)
+        if scaling[metric]:
+            print(f"\n{title}: scaling with the number of trees and particles")
+            print_scaling(scaling[metric])
+
+    if args.json:
+        entries = []
+        for (model, trees, particles), result in cells.items():
+            entry = {"model": model, "trees": trees, "particles": particles, **result}
+            # Only the sources measured for the cell
+            if "time" in result:
+                entry["time_shares"] = shares(result["time"], "time_s")
+            if "memory" in result:
+                entry["memory_shares"] = shares(result["memory"], "bytes")
+            entries.append(entry)
+        report = {"cells": entries, "scaling": scaling}
+        Path(args.json).write_text(json.dumps(report, indent=2))
+        print(f"\nReport written to {args.json}")
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,13 +1,122 @@
+import matplotlib.pyplot as plt
 import numpy as np
-from scipy.stats import pearsonr
 from arviz import hdi
 
-from pymc_bart.utils import plot_variable_importance, _sample_posterior
+
+class PosteriorDraws:
+    """Trees of the selected posterior draws of a BART variable.
+
+    The trees of each distinct draw are read from `all_trees` once, when the object is
+    created, and are predicted once per call even if `idx` selects them several times.
+
+    Parameters
+    ----------
+    all_trees : list
+        Posterior trees of a BART variable, i.e. ``bartrv.owner.op.all_trees``.
+    idx : array-like
+        Indices of the posterior draws.
+    """
+
+    def __init__(self, all_trees, idx):
+        unique_idx, self.inverse = np.unique(idx, return_inverse=True)
+        self.trees = [all_trees[i] for i in unique_idx]
+
+    def predict(self, X, excluded=None):
+        """Predictions with shape (len(idx), n), flattened like `_sample_posterior`.
+
+        Parameters
+        ----------
+        X : array-like
+            Covariates matrix with the same columns used to fit the model.
+        excluded : list, optional
+            Indices of the variables to exclude when predicting.
+        """
+        trees_shape = len(self.trees[0])
+        pred = np.zeros((len(self.trees), trees_shape, X.shape[0]))
+        for p, draw in zip(pred, self.trees):
+            for odim, odim_trees in enumerate(draw):
+                for tree in odim_trees:
+                    p[odim] += tree.predict(x=X, excluded=excluded)[0]
+        return pred[self.inverse].reshape(len(self.inverse), -1)
+
+
+def pearson_r2(reference, predicted):
+    """Squared Pearson correlation between the last axes of two arrays.
+
+    Parameters
+    ----------
+    reference : ndarray
+        Array with shape (..., n).
+    predicted : ndarray
+        Array broadcastable to `reference`, e.g. (submodels, draws, n) against
+        (draws, n).
+
+    Returns
+    -------
+    ndarray
+        R² with the broadcast shape of the leading axes.
+    """
+    reference = reference - reference.mean(-1, keepdims=True)
+    predicted = predicted - predicted.mean(-1, keepdims=True)
+    covariance = (reference * predicted).sum(-1)
+    return covariance**2 / ((reference**2).sum(-1) * (predicted**2).sum(-1))
+
+
+def implicit_r2(draws, X, predicted_all, inclusion, method):
+    """R² of the full model with the least important variables excluded.
+
+    Follows the ranking of `pymc_bart.utils.plot_variable_importance`, but every
+    subset is predicted with the same posterior `draws`.
+
+    Returns
+    -------
+    indices : list
+        Indices of the variables, from the most to the least important.
+    r2 : ndarray
+        R² with shape (n_vars, draws). Row ``k`` includes the ``k + 1`` most
+        important variables.
+    """
+    n_vars = X.shape[1]
+    r2 = np.zeros((n_vars, len(predicted_all)))
+
+    if method == "VI":
+        idxs = np.argsort(inclusion)
+        for k in range(n_vars):
+            excluded = idxs[: n_vars - 1 - k].tolist()
+            r2[k] = pearson_r2(predicted_all, draws.predict(X, excluded))
+        return list(idxs[::-1]), r2
+
+    if method != "backward":
+        raise ValueError(f"method must be 'VI' or 'backward', not {method!r}")
+
+    # Backward search: at each stage, exclude the variable whose removal keeps the
+    # highest mean R² together with the ones already excluded
+    excluded = []
+    for stage in range(n_vars):
+        candidates = [[]] if stage == 0 else [[i] for i in range(n_vars)]
+        best = None
+        for candidate in candidates:
+            if candidate and candidate[0] in excluded:
+                continue
+            predicted = draws.predict(X, excluded + candidate)
+            r2_candidate = pearson_r2(predicted_all, predicted)
+            if best is None or r2_candidate.mean() > best[1].mean():
+                best = candidate, r2_candidate
+        excluded += best[0]
+        r2[n_vars - 1 - stage] = best[1]
+    # The variable never excluded is the most important one
+    indices = [i for i in range(n_vars) if i not in excluded] + excluded[::-1]
+    return indices, r2
 
 
 def vi_evi(bart_rvs, idatas, X, indices, method, samples, seed, figsize):
     """Compare the explicit vs implicit variable importance computation.
 
+    The predictions of the full model are compared against those of the full model
+    without the least important variables (implicit) and of the models fitted with
+    only the most important variables (explicit). All of these use the same indices
+    of posterior draws, and the R² of every draw is computed at once.
+
     Parameters
     ----------
     bart_rvs : list
@@ -28,49 +137,58 @@ def vi_evi(bart_rvs, idatas, X, indices, method, samples, seed, figsize):
         The figure size.
     """
     rng = np.random.default_rng(seed)
+    n_vars = X.shape[1]
+    X_sorted = X.iloc[:, indices]
 
-    _, ax = plot_variable_importance(
-        idatas[-1],
-        bart_rvs[-1],
-        X.iloc[:, indices],
-        method=method,
-        samples=samples,
-        xlabel_angle=45,
-        figsize=figsize,
-        random_seed=seed,
-    )
+    # The reference predictions use other draws than the ones they are compared to,
+    # so that the R² of the full model against itself reflects the posterior
+    # uncertainty, as in `plot_variable_importance`
+    n_draws = min(len(bart_rv.owner.op.all_trees) for bart_rv in bart_rvs)
+    idx_all = rng.integers(0, n_draws, size=samples)
+    idx = rng.integers(0, n_draws, size=samples)
+
+    all_trees = bart_rvs[-1].owner.op.all_trees
+    predicted_all = PosteriorDraws(all_trees, idx_all).predict(X_sorted.values)
 
-    predicted_all = _sample_posterior(
-        bart_rvs[-1].owner.op.all_trees,
-        X=X.iloc[:, indices].values,
-        rng=rng,
-        size=samples,
+    # Implicit: the full model with the least important variables excluded
+    inclusion = (
+        idatas[-1]["sample_stats"]["variable_inclusion"].mean(("chain", "draw")).values
     )
-    ev_mean = np.zeros(X.shape[1])
-    ev_hdi = np.zeros((X.shape[1], 2))
-
-    for idx in range(X.shape[1]):
-        predicted_subset = _sample_posterior(
-            bart_rvs[idx].owner.op.all_trees,
-            X=X.iloc[:, indices[: idx + 1]].values,
-            rng=rng,
-            size=samples,
-        )
-        pearson = np.zeros(samples)
-        for j in range(samples):
-            pearson[j] = (
-                pearsonr(predicted_all[j].flatten(), predicted_subset[j].flatten())[0]
-            ) ** 2
-        ev_mean[idx] = np.mean(pearson)
-        ev_hdi[idx] = hdi(pearson)
-
-    ticks = np.arange(X.shape[1], dtype=int)
-    ax.errorbar(
-        ticks,
-        ev_mean,
-        np.array((ev_mean - ev_hdi[:, 0], ev_hdi[:, 1] - ev_mean)),
-        color="C1",
-        alpha=0.5,
+    implicit_indices, implicit = implicit_r2(
+        PosteriorDraws(all_trees, idx),
+        X_sorted.values,
+        predicted_all,
+        inclusion,
+        method,
     )
 
+    # Explicit: the models fitted with the `k + 1` most important variables
+    explicit = np.zeros((n_vars, samples))
+    for k in range(n_vars):
+        draws = PosteriorDraws(bart_rvs[k].owner.op.all_trees, idx)
+        explicit[k] = pearson_r2(
+            predicted_all, draws.predict(X.iloc[:, indices[: k + 1]].values)
+        )
+
+    _, ax = plt.subplots(1, 1, figsize=figsize)
+    ticks = np.arange(n_vars, dtype=int)
+    labels = X_sorted.columns[implicit_indices]
+    labels = [label if i == 0 else f"+ {label}" for i, label in enumerate(labels)]
+
+    for r2, color, alpha in [(implicit, "C0", 1), (explicit, "C1", 0.5)]:
+        r2_mean = r2.mean(1)
+        r2_hdi = np.array([hdi(row) for row in r2])
+        ax.errorbar(
+            ticks,
+            r2_mean,
+            np.clip((r2_mean - r2_hdi[:, 0], r2_hdi[:, 1] - r2_mean), 0, None),
+            color=color,
+            alpha=alpha,
+        )
+    ax.axhline(implicit[-1].mean(), ls="--", color="0.5")
+    ax.set_xticks(ticks, labels, rotation=45)
+    ax.set_ylabel("R²", rotation=0, labelpad=12)
+    ax.set_ylim(0, 1)
+    ax.set_xlim(-0.5, n_vars - 0.5)
+
     return ax